@@ -1,20 +1,92 @@
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash
-from models import db, Book, Loan, create_app
+from flask import Flask, render_template, request, redirect, url_for, flash, abort
+from sqlalchemy.orm import contains_eager, joinedload
+from models import (
+    db, Book, BookBorrowCount, BookBorrowDaily, BookRelated, Borrower, Loan, LoanArchive, create_app,
+    bump_catalog_version, borrower_id_for, lock_borrowers, active_loan_count,
+)
 from forms import BookForm, BorrowForm
+from cache import cached_view, conditional_view, init_cache, vary_by_day
+from commands import register_commands
+from export import EXPORT_FORMATS, parse_since, stream_export
+from facets import DEFAULT_YEAR_BUCKET, FACETS, compute_facets
+from loan_batch import BATCH_MAX_OPERATIONS, BatchConflict, apply_loan_batch
+from loan_history import history_page
+from pagination import COUNT_MODES, InvalidCursor, estimate_count, keyset_page
+from popularity import POPULAR_WINDOWS, popular_books, record_borrows
+from recommendations import related_books
+from search import init_search, search_books
+from suggest import get_suggest_index, index_book, init_suggest, unindex_book
+from textnorm import name_key
 
 app = create_app()
+init_search(app)
+init_cache(app)
+register_commands(app)
+init_suggest(app)
+
+# Số dòng tối đa cho mỗi bảng trên trang tổng quan
+DASHBOARD_LIMIT = 10
+
+# Cột có thể chọn qua ?fields= của /api/books
+BOOK_API_FIELDS = {
+    column.key: column
+    for column in (
+        Book.id, Book.isbn, Book.title, Book.author, Book.genre, Book.year,
+        Book.total_copies, Book.available_copies, Book.updated_at,
+    )
+}
+DEFAULT_BOOK_FIELDS = ["id", "title", "author", "genre", "year"]
+
+# Số phiếu mượn mỗi trang (HTML) và giới hạn ?limit= của /api/loans
+LOANS_PAGE_SIZE = 20
+LOANS_API_MAX_LIMIT = 100
+LOAN_API_FIELDS = ["id", "book_id", "title", "borrower", "borrowed_at", "returned_at"]
 
 
 @app.route("/")
+@cached_view
+@vary_by_day  # bảng xếp hạng tuần/tháng trượt theo ngày
 def index():
-    books = Book.query.order_by(Book.title.asc()).all()
-    recent_loans = Loan.query.order_by(Loan.borrowed_at.desc()).limit(10).all()
-    return render_template("index.html", books=books, recent_loans=recent_loans)
+    # Chỉ số tổng hợp: một câu aggregate thay vì nạp toàn bộ danh mục
+    totals = db.session.execute(
+        db.select(
+            db.func.count(Book.id).label("titles"),
+            db.func.coalesce(db.func.sum(Book.total_copies), 0).label("copies"),
+            db.func.coalesce(db.func.sum(Book.total_copies - Book.available_copies), 0).label("copies_out"),
+        )
+    ).one()
+
+    genres = db.session.execute(
+        db.select(Book.genre, db.func.count(Book.id).label("books"))
+        .group_by(Book.genre)
+        .order_by(db.desc("books"))
+        .limit(DASHBOARD_LIMIT)
+    ).all()
+
+    # Mượn nhiều nhất tuần/tháng/mọi lúc: đọc bảng đếm, không GROUP BY trên loan
+    popular = {window: popular_books(window, DASHBOARD_LIMIT) for window in POPULAR_WINDOWS}
+
+    # joinedload: lấy luôn Book trong cùng câu truy vấn (tránh N+1 khi template đọc l.book.title)
+    recent_loans = (
+        Loan.query.options(joinedload(Loan.book))
+        .order_by(Loan.borrowed_at.desc())
+        .limit(DASHBOARD_LIMIT)
+        .all()
+    )
+    return render_template(
+        "index.html",
+        totals=totals,
+        genres=genres,
+        popular=popular,
+        recent_loans=recent_loans,
+    )
 
 
 # Books CRUD
 @app.route("/books")
+@conditional_view
+@cached_view
 def list_books():
     # Lấy tham số từ query string
     search = request.args.get("q", "", type=str)
@@ -22,14 +94,13 @@ def list_books():
     limit = request.args.get("limit", 5, type=int)
 
     # Câu truy vấn cơ bản
-    query = Book.query.order_by(Book.title.asc())
+    query = Book.query
 
-    # Nếu có từ khóa tìm kiếm
+    # Nếu có từ khóa tìm kiếm: lọc qua chỉ mục FTS, xếp theo độ liên quan trước
     if search:
-        query = query.filter(
-            (Book.title.ilike(f"%{search}%")) |
-            (Book.author.ilike(f"%{search}%"))
-        )
+        query = search_books(query, search)
+    # title_sort: thứ tự chữ cái tiếng Việt, đi theo chỉ mục (title_sort, id)
+    query = query.order_by(Book.title_sort.asc(), Book.id.asc())
 
     # Phân trang
     pagination = query.paginate(page=page, per_page=limit, error_out=False)
@@ -58,7 +129,9 @@ def create_book():
             available_copies=form.total_copies.data,
         )
         db.session.add(book)
+        bump_catalog_version()
         db.session.commit()
+        index_book(book)
         flash("Đã thêm sách", "success")
         return redirect(url_for("list_books"))
     return render_template("book_form.html", form=form, mode="create")
@@ -74,7 +147,9 @@ def edit_book(book_id):
         book.author = form.author.data
         book.total_copies = form.total_copies.data
         book.available_copies = max(0, book.available_copies + delta)
+        bump_catalog_version()
         db.session.commit()
+        index_book(book)
         flash("Đã cập nhật sách", "success")
         return redirect(url_for("list_books"))
     else:
@@ -89,8 +164,15 @@ def delete_book(book_id):
     if Loan.query.filter_by(book_id=book.id, returned_at=None).count() > 0:
         flash("Không thể xoá: sách đang được mượn", "danger")
         return redirect(url_for("list_books"))
+    db.session.execute(db.delete(BookBorrowCount).where(BookBorrowCount.book_id == book.id))
+    db.session.execute(db.delete(BookBorrowDaily).where(BookBorrowDaily.book_id == book.id))
+    db.session.execute(db.delete(BookRelated).where(
+        (BookRelated.book_id == book.id) | (BookRelated.related_book_id == book.id)
+    ))
     db.session.delete(book)
+    bump_catalog_version()
     db.session.commit()
+    unindex_book(book_id)
     flash("Đã xoá sách", "success")
     return redirect(url_for("list_books"))
 
@@ -100,70 +182,388 @@ def delete_book(book_id):
 def loans():
     form = BorrowForm()
     if form.validate_on_submit():
-        book = Book.query.get(form.book_id.data)
-        if not book:
-            flash("Không tìm thấy sách", "danger")
-        elif book.available_copies <= 0:
-            flash("Hết sách để mượn", "warning")
-        else:
-            loan = Loan(book_id=book.id, borrower=form.borrower.data)
-            book.available_copies -= 1
-            db.session.add(loan)
+        book_id = form.book_id.data
+        borrower_id = borrower_id_for(form.borrower.data)
+        max_active = app.config["MAX_ACTIVE_LOANS_PER_BORROWER"]
+        if max_active:
+            lock_borrowers([borrower_id])
+        # Trừ tồn kho bằng một UPDATE có điều kiện (không đọc-sửa-ghi trong Python),
+        # rồi thêm phiếu mượn trong cùng một transaction ngắn
+        taken = db.session.execute(
+            db.update(Book)
+            .where(Book.id == book_id, Book.available_copies > 0)
+            .values(available_copies=Book.available_copies - 1)
+        ).rowcount
+        # Hai lượt mượn đồng thời của cùng một người không cùng lọt qua giới hạn: trên PostgreSQL
+        # nhờ khoá dòng borrower ở trên, trên SQLite vì đếm sau khi ghi (đang giữ khoá ghi cả DB)
+        if taken and max_active and active_loan_count(borrower_id) >= max_active:
+            db.session.rollback()
+            flash(f"Mỗi người chỉ được mượn tối đa {max_active} cuốn cùng lúc", "warning")
+        elif taken:
+            db.session.add(Loan(book_id=book_id, borrower=form.borrower.data, borrower_id=borrower_id))
+            record_borrows([book_id])
+            bump_catalog_version()
             db.session.commit()
             flash("Mượn sách thành công", "success")
+        else:
+            db.session.rollback()
+            if db.session.get(Book, book_id) is None:
+                flash("Không tìm thấy sách", "danger")
+            else:
+                flash("Hết sách để mượn", "warning")
         return redirect(url_for("loans"))
     elif request.method == "POST":
         print("Form errors:", form.errors)
 
-    active_loans = Loan.query.filter_by(returned_at=None).order_by(Loan.borrowed_at.desc()).all()
-    return render_template("loans.html", form=form, active_loans=active_loans)
+    # Một truy vấn/trang: JOIN sách ngay trong câu lấy phiếu (không N+1 khi đọc loan.book),
+    # seek theo (borrowed_at, id) trên chỉ mục phiếu đang mở
+    query = (
+        Loan.query.join(Loan.book)
+        .options(contains_eager(Loan.book))
+        .filter(Loan.returned_at.is_(None))
+    )
+    try:
+        active_loans, next_cursor, prev_cursor = keyset_page(
+            query, (Loan.borrowed_at, Loan.id), request.args.get("cursor"), LOANS_PAGE_SIZE, descending=True
+        )
+    except InvalidCursor:
+        abort(400)
+    return render_template(
+        "loans.html", form=form, active_loans=active_loans, next_cursor=next_cursor, prev_cursor=prev_cursor
+    )
 
 
 @app.route("/loans/<int:loan_id>/return", methods=["POST"])
 def return_book(loan_id):
-    loan = Loan.query.get_or_404(loan_id)
-    if loan.returned_at is None:
-        loan.returned_at = datetime.utcnow()
-        book = Book.query.get(loan.book_id)
-        book.available_copies = min(book.total_copies, book.available_copies + 1)
+    # Chỉ phiếu còn mở mới được đánh dấu trả; cộng lại tồn kho (không vượt total_copies)
+    returned = db.session.execute(
+        db.update(Loan)
+        .where(Loan.id == loan_id, Loan.returned_at.is_(None))
+        .values(returned_at=datetime.utcnow())
+    ).rowcount
+    if returned:
+        db.session.execute(
+            db.update(Book)
+            .where(Book.id == db.select(Loan.book_id).where(Loan.id == loan_id).scalar_subquery())
+            .values(available_copies=db.case(
+                (Book.available_copies < Book.total_copies, Book.available_copies + 1),
+                else_=Book.available_copies,
+            ))
+        )
+        bump_catalog_version()
         db.session.commit()
         flash("Đã trả sách", "success")
     else:
+        db.session.rollback()
+        if db.session.get(Loan, loan_id) is None:
+            abort(404)
         flash("Phiếu mượn đã được trả trước đó", "info")
     return redirect(url_for("loans"))
 
 
-if __name__ == "__main__":
-    app.run(debug=True)
-
-
 @app.route("/api/books")
+@conditional_view
+@cached_view
 def api_books():
     search = request.args.get("q", "", type=str)
     page = request.args.get("page", 1, type=int)
     limit = request.args.get("limit", 5, type=int)
+    # ?cursor= (kể cả rỗng) bật chế độ keyset; mặc định khi đó không đếm tổng
+    cursor = request.args.get("cursor", type=str)
+    count = request.args.get("count", "exact" if cursor is None else "none", type=str)
+    if count not in COUNT_MODES:
+        return {"error": f"count phải là một trong {', '.join(COUNT_MODES)}"}, 400
+    # ?fields=id,title: chỉ SELECT các cột được yêu cầu, trả về dạng row thay vì entity ORM
+    fields = [f for f in request.args.get("fields", "", type=str).split(",") if f] or DEFAULT_BOOK_FIELDS
+    unknown = [f for f in fields if f not in BOOK_API_FIELDS]
+    if unknown:
+        return {"error": f"fields không hợp lệ: {', '.join(unknown)}"}, 400
+    # ?facets=genre,year: đếm theo thể loại / khoảng năm (?year_bucket=10) trên tập đã lọc
+    facets = [f for f in request.args.get("facets", "", type=str).split(",") if f]
+    if any(f not in FACETS for f in facets):
+        return {"error": f"facets phải thuộc {', '.join(FACETS)}"}, 400
+    year_bucket = request.args.get("year_bucket", DEFAULT_YEAR_BUCKET, type=int)
+    if year_bucket < 1:
+        return {"error": "year_bucket phải >= 1"}, 400
 
-    query = Book.query.order_by(Book.title.asc())
+    # title_sort, id luôn được lấy (đặt sau các cột yêu cầu) để sắp xếp/tạo cursor
+    keys = [c for c in (Book.title_sort, Book.id) if c.key not in fields]
+    query = db.session.query(*(BOOK_API_FIELDS[f] for f in fields), *keys)
     if search:
-        query = query.filter(
-            (Book.title.ilike(f"%{search}%")) |
-            (Book.author.ilike(f"%{search}%"))
+        query = search_books(query, search)
+
+    if cursor is not None:
+        try:
+            books, next_cursor, prev_cursor = keyset_page(query, (Book.title_sort, Book.id), cursor, limit)
+        except InvalidCursor:
+            return {"error": "cursor không hợp lệ"}, 400
+        body = {"next_cursor": next_cursor, "prev_cursor": prev_cursor}
+    else:
+        pagination = query.order_by(Book.title_sort.asc(), Book.id.asc()).paginate(
+            page=page, per_page=limit, error_out=False, count=(count == "exact")
         )
+        books = pagination.items
+        body = {
+            "page": pagination.page,
+            "total_pages": pagination.pages if count == "exact" else None,
+        }
+        if count == "exact":
+            body["total_items"] = pagination.total
 
-    pagination = query.paginate(page=page, per_page=limit, error_out=False)
+    if count == "estimate":
+        upper_bound = None if search else (lambda: db.session.query(db.func.max(Book.id)).scalar())
+        body["total_items"], body["total_estimated"] = estimate_count(query, upper_bound)
+    elif count == "exact" and "total_items" not in body:
+        body["total_items"] = query.order_by(None).count()
+
+    body["results"] = [dict(zip(fields, row)) for row in books]
+    if facets:
+        body["facets"] = compute_facets(facets, search, year_bucket)
+    return body
+
+@app.route("/api/books/suggest")
+def suggest_books():
+    q = request.args.get("q", "", type=str)
+    limit = min(max(request.args.get("limit", 8, type=int), 1), 20)
+    index = get_suggest_index()
+    suggestions = index.suggest(q, limit)
+
+    # Sách có thể đã bị worker khác xoá: kiểm tra theo khoá chính (vài id) rồi loại khỏi chỉ mục
+    ids = [s["book_id"] for s in suggestions if "book_id" in s]
+    if ids:
+        existing = set(db.session.scalars(db.select(Book.id).where(Book.id.in_(ids))))
+        for book_id in set(ids) - existing:
+            index.remove(book_id)
+        suggestions = [s for s in suggestions if s.get("book_id", 0) in existing or "book_id" not in s]
+    return {"q": q, "suggestions": suggestions}
+
+
+@app.route("/api/books/popular")
+@conditional_view
+@cached_view
+@vary_by_day
+def api_popular_books():
+    window = request.args.get("window", "week", type=str)
+    if window not in POPULAR_WINDOWS:
+        return {"error": f"window phải là một trong {', '.join(POPULAR_WINDOWS)}"}, 400
+    limit = min(max(request.args.get("limit", DASHBOARD_LIMIT, type=int), 1), 100)
     return {
-        "page": pagination.page,
-        "total_pages": pagination.pages,
-        "total_items": pagination.total,
+        "window": window,
         "results": [
-            {
-                "id": b.id,
-                "title": b.title,
-                "author": b.author,
-                "genre": b.genre,
-                "year": b.year
-            } for b in pagination.items
-        ]
+            {"id": row.id, "title": row.title, "author": row.author, "loans": row.loans}
+            for row in popular_books(window, limit)
+        ],
     }
 
 
+@app.route("/api/books/<int:book_id>/related")
+@conditional_view
+@cached_view
+def api_related_books(book_id):
+    if db.session.get(Book, book_id) is None:
+        return {"error": "không tìm thấy sách"}, 404
+    limit = min(max(request.args.get("limit", DASHBOARD_LIMIT, type=int), 1), 50)
+    return {
+        "book_id": book_id,
+        "results": [
+            {"id": row.id, "title": row.title, "author": row.author, "score": row.score}
+            for row in related_books(book_id, limit)
+        ],
+    }
+
+
+@app.route("/api/books/export")
+def export_books():
+    search = request.args.get("q", "", type=str)
+    fmt = request.args.get("format", "ndjson", type=str)
+    if fmt not in EXPORT_FORMATS:
+        return {"error": f"format phải là một trong {', '.join(EXPORT_FORMATS)}"}, 400
+    try:
+        since = parse_since(request.args.get("since"))
+    except ValueError:
+        return {"error": "since phải theo định dạng ISO 8601"}, 400
+
+    stmt = db.select(
+        Book.id, Book.isbn, Book.title, Book.author, Book.genre, Book.year,
+        Book.total_copies, Book.available_copies, Book.updated_at,
+    )
+    if search:
+        stmt = search_books(stmt, search)
+    # Thứ tự theo chỉ mục để DB trả dần từng dòng, không phải sắp xếp cả tập kết quả
+    if since:
+        stmt = stmt.where(Book.updated_at >= since).order_by(None).order_by(Book.updated_at, Book.id)
+    else:
+        stmt = stmt.order_by(None).order_by(Book.id)
+    return stream_export(stmt, fmt, "books")
+
+
+@app.route("/api/loans/export")
+def export_loans():
+    status = request.args.get("status", "", type=str)
+    if status not in ("", "active", "returned"):
+        return {"error": "status phải là active hoặc returned (bỏ trống để xuất tất cả)"}, 400
+    book_id = request.args.get("book_id", type=int)
+    borrower = request.args.get("borrower", "", type=str)
+    fmt = request.args.get("format", "ndjson", type=str)
+    if fmt not in EXPORT_FORMATS:
+        return {"error": f"format phải là một trong {', '.join(EXPORT_FORMATS)}"}, 400
+    try:
+        since = parse_since(request.args.get("since"))
+    except ValueError:
+        return {"error": "since phải theo định dạng ISO 8601"}, 400
+
+    # loan_archive có thể ở DB khác nên tra borrower_id trước thay vì subquery
+    borrower_id = _borrower_id(borrower) if borrower else None
+    # phiếu đang mở chỉ có ở bảng loan; phiếu đã trả gồm cả loan_archive (xuất sau bảng loan)
+    stmts = []
+    for model in (Loan,) if status == "active" else (Loan, LoanArchive):
+        stmt = db.select(model.id, model.book_id, model.borrower, model.borrowed_at, model.returned_at)
+        if status == "active":
+            stmt = stmt.where(model.returned_at.is_(None))
+        elif status == "returned":
+            stmt = stmt.where(model.returned_at.is_not(None))
+        if book_id:
+            stmt = stmt.where(model.book_id == book_id)
+        if borrower:
+            stmt = stmt.where(model.borrower_id == borrower_id if borrower_id else db.false())
+        if since:
+            # phiếu mượn mới hoặc vừa được trả kể từ `since`
+            stmt = stmt.where((model.borrowed_at >= since) | (model.returned_at >= since))
+        stmts.append(stmt.order_by(model.id))
+    return stream_export(stmts, fmt, "loans")
+
+
+@app.route("/api/loans")
+@conditional_view
+@cached_view
+def api_loans():
+    status = request.args.get("status", "active", type=str)
+    if status not in ("active", "returned"):
+        return {"error": "status phải là active hoặc returned"}, 400
+    borrower = request.args.get("borrower", "", type=str)
+    limit = min(request.args.get("limit", LOANS_PAGE_SIZE, type=int), LOANS_API_MAX_LIMIT)
+
+    if status == "returned":
+        # Mới trả trước, trộn loan với loan_archive (phiếu đã trả lâu ngày)
+        borrower_id = _borrower_id(borrower) if borrower else None
+        if borrower and borrower_id is None:
+            return {"status": status, "next_cursor": None, "prev_cursor": None, "results": []}
+        try:
+            results, next_cursor, prev_cursor = history_page(
+                request.args.get("cursor"), limit, borrower_id=borrower_id, status="returned",
+                order_by="returned_at",
+            )
+        except InvalidCursor:
+            return {"error": "cursor không hợp lệ"}, 400
+        return {"status": status, "next_cursor": next_cursor, "prev_cursor": prev_cursor, "results": results}
+
+    # Phiếu đang mở: mới mượn trước (chỉ có ở bảng loan)
+    query = (
+        db.session.query(Loan.id, Loan.book_id, Book.title, Loan.borrower, Loan.borrowed_at, Loan.returned_at)
+        .join(Loan.book)
+        .filter(Loan.returned_at.is_(None))
+    )
+    if borrower:
+        query = query.filter(Loan.borrower_id == _borrower_id_subquery(borrower))
+
+    try:
+        rows, next_cursor, prev_cursor = keyset_page(
+            query, (Loan.borrowed_at, Loan.id), request.args.get("cursor"), limit, descending=True
+        )
+    except InvalidCursor:
+        return {"error": "cursor không hợp lệ"}, 400
+    return {
+        "status": status,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "results": [dict(zip(LOAN_API_FIELDS, row)) for row in rows],
+    }
+
+
+
+@app.route("/api/loans/batch", methods=["POST"])
+def api_loans_batch():
+    # {"operations": [{"op": "borrow", "book_id": 1, "borrower": "..."}, {"op": "return", "loan_id": 7}],
+    #  "atomic": false}
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("operations"), list):
+        return {"error": "body phải là JSON dạng {\"operations\": [...]}"}, 400
+    operations = payload["operations"]
+    if not operations or len(operations) > BATCH_MAX_OPERATIONS:
+        return {"error": f"operations phải có từ 1 đến {BATCH_MAX_OPERATIONS} thao tác"}, 400
+    atomic = payload.get("atomic", False) is True
+
+    try:
+        results, applied = apply_loan_batch(operations, atomic, app.config["MAX_ACTIVE_LOANS_PER_BORROWER"])
+    except BatchConflict:
+        return {"error": "dữ liệu vừa bị thay đổi bởi request khác, hãy gửi lại lô"}, 409
+    body = {"applied": applied, "results": results}
+    if atomic and not applied:
+        body["error"] = "có thao tác không hợp lệ, không thao tác nào được ghi"
+        return body, 400
+    return body
+
+
+@app.route("/api/borrowers/<int:borrower_id>/loans")
+@conditional_view
+@cached_view
+def api_borrower_loans(borrower_id):
+    borrower = db.session.get(Borrower, borrower_id)
+    if borrower is None:
+        return {"error": "không tìm thấy người mượn"}, 404
+    status = request.args.get("status", "", type=str)
+    if status not in ("", "active", "returned"):
+        return {"error": "status phải là active hoặc returned"}, 400
+    limit = min(request.args.get("limit", LOANS_PAGE_SIZE, type=int), LOANS_API_MAX_LIMIT)
+
+    # Lịch sử theo ix_loan_borrower_borrowed (+ phiếu đã lưu trữ), mới mượn trước
+    try:
+        results, next_cursor, prev_cursor = history_page(
+            request.args.get("cursor"), limit, borrower_id=borrower_id, status=status
+        )
+    except InvalidCursor:
+        return {"error": "cursor không hợp lệ"}, 400
+    return {
+        "borrower": {"id": borrower.id, "name": borrower.name},
+        "active_loans": active_loan_count(borrower_id),
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "results": results,
+    }
+
+
+@app.route("/api/loans/history")
+@conditional_view
+@cached_view
+def api_loan_history():
+    borrower = request.args.get("borrower", "", type=str)
+    book_id = request.args.get("book_id", type=int)
+    limit = min(request.args.get("limit", LOANS_PAGE_SIZE, type=int), LOANS_API_MAX_LIMIT)
+
+    borrower_id = None
+    if borrower:
+        # tra id trước: loan_archive có thể ở DB khác, không dùng subquery sang bảng borrower được
+        borrower_id = db.session.scalar(db.select(Borrower.id).where(Borrower.name_key == name_key(borrower)))
+        if borrower_id is None:
+            return {"next_cursor": None, "prev_cursor": None, "results": []}
+    try:
+        results, next_cursor, prev_cursor = history_page(
+            request.args.get("cursor"), limit, borrower_id=borrower_id, book_id=book_id
+        )
+    except InvalidCursor:
+        return {"error": "cursor không hợp lệ"}, 400
+    return {"next_cursor": next_cursor, "prev_cursor": prev_cursor, "results": results}
+
+
+def _borrower_id_subquery(name: str):
+    """?borrower=<tên>: tra theo khoá tên đã chuẩn hoá (chỉ mục unique) thay vì so chuỗi trên loan."""
+    return db.select(Borrower.id).where(Borrower.name_key == name_key(name)).scalar_subquery()
+
+
+def _borrower_id(name: str) -> int | None:
+    """Như _borrower_id_subquery nhưng tra trước, cho truy vấn trên loan_archive (có thể ở DB khác)."""
+    return db.session.scalar(db.select(Borrower.id).where(Borrower.name_key == name_key(name)))
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
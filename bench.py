@@ -0,0 +1,279 @@
+"""
+Benchmark toàn bộ app ở kích thước dữ liệu thực tế
+Sinh danh mục sách/phiếu mượn tiếng Việt giả lập, gọi mọi route qua Flask test client và in
+JSON: p50/p95/p99 (ms), số câu SQL mỗi request (X-DB-Queries), peak RSS. Lưu JSON của hai
+nhánh rồi so sánh để bắt hồi quy hiệu năng.
+
+Chạy:
+  python bench.py --books 10000 --loans 50000
+  python bench.py --books 1000000 --loans 5000000 --db /tmp/bench-1m.db   # DB được giữ lại,
+                                                                          # lần sau bỏ qua bước sinh
+  python bench.py --output bench-main.json --profile production
+Cache response bị tắt (đo đường DB) trừ khi có --cache.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# --- cấu hình môi trường trước khi import app (DATABASE_URL, DB_PROFILE đọc lúc create_app) ---
+_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+_parser.add_argument("--books", type=int, default=10000)
+_parser.add_argument("--loans", type=int, default=50000)
+_parser.add_argument("--borrowers", type=int, default=None, help="mặc định books // 2")
+_parser.add_argument("--active-ratio", type=float, default=0.02, help="tỉ lệ phiếu còn mở")
+_parser.add_argument("--requests", type=int, default=200, help="số request đo cho mỗi route")
+_parser.add_argument("--warmup", type=int, default=10)
+_parser.add_argument("--db", help="file SQLite; đã có dữ liệu thì dùng lại (mặc định: file tạm)")
+_parser.add_argument("--profile", choices=["default", "production"], default="default")
+_parser.add_argument("--cache", action="store_true", help="bật cache response như khi chạy thật")
+_parser.add_argument("--seed", type=int, default=42)
+_parser.add_argument("--output", help="ghi JSON ra file thay vì stdout")
+args = _parser.parse_args()
+
+_tmpdir = tempfile.TemporaryDirectory()
+db_path = os.path.abspath(args.db) if args.db else os.path.join(_tmpdir.name, "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+os.environ["DB_PROFILE"] = args.profile
+os.environ.setdefault("SUGGEST_PRELOAD", "0")
+os.environ.setdefault("SLOW_QUERY_THRESHOLD_MS", "")
+
+from app import app  # noqa: E402
+from migrations import backfill_borrow_counters  # noqa: E402
+from models import db, Book, Borrower, Loan, bump_catalog_version  # noqa: E402
+from search import fts_enabled, rebuild_search_index  # noqa: E402
+from textnorm import name_key, sort_key  # noqa: E402
+
+app.config["WTF_CSRF_ENABLED"] = False
+app.config["MAX_ACTIVE_LOANS_PER_BORROWER"] = 0
+if not args.cache:
+    app.extensions.pop("response_cache", None)
+    app.extensions.pop("facet_cache", None)
+
+INSERT_BATCH = 10000
+
+PREFIXES = ["Nhập môn", "Giáo trình", "Tuyển tập", "Lược sử", "Hướng dẫn", "Thực hành",
+            "Những bài học về", "Bí quyết", "Cẩm nang", "Tìm hiểu"]
+TOPICS = ["lập trình", "cơ sở dữ liệu", "mạng máy tính", "trí tuệ nhân tạo", "kinh tế học", "lịch sử",
+          "văn học", "toán học", "vật lý", "hóa học", "sinh học", "triết học", "tâm lý học",
+          "nghệ thuật", "âm nhạc", "địa lý", "quản trị", "tiếp thị", "kế toán", "y học"]
+SUFFIXES = ["Việt Nam", "thế kỷ 21", "cho người mới bắt đầu", "hiện đại", "ứng dụng", "toàn tập",
+            "tập 1", "tập 2", "qua các thời kỳ", "và cuộc sống", "nâng cao", "cơ bản"]
+SURNAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng",
+            "Bùi", "Đỗ", "Hồ", "Ngô", "Dương", "Lý"]
+MIDDLE = ["Văn", "Thị", "Minh", "Hồng", "Đức", "Thanh", "Quang", "Ngọc", "Anh", "Hữu", "Thu", "Gia"]
+GIVEN = ["An", "Bình", "Châu", "Dũng", "Giang", "Hà", "Hải", "Hùng", "Khánh", "Lan", "Linh", "Long",
+         "Mai", "Nam", "Phúc", "Quân", "Sơn", "Thảo", "Trang", "Tú", "Việt", "Yến", "Ánh", "Đạt"]
+QUERIES = ["lap trinh", "Cơ sở dữ liệu", "lịch sử việt nam", "toan", "Nguyễn Văn", "triet hoc",
+           "tâm lý", "y hoc hien dai", "kế toán", "am nhac"]
+
+
+def person(rng) -> str:
+    return f"{rng.choice(SURNAMES)} {rng.choice(MIDDLE)} {rng.choice(GIVEN)}"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss: KiB trên Linux, byte trên macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def generate(rng) -> dict:
+    """Sinh dữ liệu bằng Core executemany theo lô (không qua ORM) vào DB rỗng."""
+    n_books, n_loans = args.books, args.loans
+    n_borrowers = args.borrowers or max(n_books // 2, 1)
+    start = time.perf_counter()
+
+    totals = [rng.randint(1, 10) for _ in range(n_books)]
+    for lo in range(0, n_books, INSERT_BATCH):
+        rows = []
+        for i in range(lo, min(lo + INSERT_BATCH, n_books)):
+            title = f"{rng.choice(PREFIXES)} {rng.choice(TOPICS)} {rng.choice(SUFFIXES)}"
+            rows.append({
+                "title": title,
+                "title_sort": sort_key(title),
+                "author": person(rng),
+                "genre": rng.choice(TOPICS).capitalize(),
+                "year": rng.randint(1950, 2025),
+                "isbn": f"978{i:010d}",
+                "total_copies": totals[i],
+                "available_copies": totals[i],
+            })
+        db.session.execute(db.insert(Book), rows)
+        db.session.commit()
+
+    names = set()
+    while len(names) < n_borrowers:
+        names.add(f"{person(rng)} {len(names)}")
+    names = sorted(names)
+    for lo in range(0, len(names), INSERT_BATCH):
+        db.session.execute(db.insert(Borrower), [
+            {"name": name, "name_key": name_key(name)} for name in names[lo:lo + INSERT_BATCH]
+        ])
+        db.session.commit()
+
+    # Phiếu đang mở chỉ được tạo khi sách còn bản -> available_copies luôn khớp
+    out = [0] * n_books
+    now = datetime.utcnow()
+    for lo in range(0, n_loans, INSERT_BATCH):
+        rows = []
+        for _ in range(lo, min(lo + INSERT_BATCH, n_loans)):
+            book = rng.randrange(n_books)
+            borrower = rng.randrange(n_borrowers)
+            borrowed_at = now - timedelta(minutes=rng.randint(60, 5 * 365 * 24 * 60))
+            returned_at = borrowed_at + timedelta(days=rng.randint(1, 60))
+            if rng.random() < args.active_ratio and out[book] < totals[book]:
+                out[book] += 1
+                returned_at = None
+            rows.append({
+                "book_id": book + 1,
+                "borrower": names[borrower],
+                "borrower_id": borrower + 1,
+                "borrowed_at": borrowed_at,
+                "returned_at": returned_at if returned_at is None or returned_at < now else now,
+            })
+        db.session.execute(db.insert(Loan), rows)
+        db.session.commit()
+
+    updates = [{"b_id": i + 1, "b_out": n} for i, n in enumerate(out) if n]
+    if updates:
+        db.session.execute(
+            db.update(Book.__table__)
+            .where(Book.__table__.c.id == db.bindparam("b_id"))
+            .values(available_copies=Book.__table__.c.total_copies - db.bindparam("b_out")),
+            updates,
+        )
+    backfill_borrow_counters(db.session.connection())
+    if fts_enabled():
+        rebuild_search_index()
+    bump_catalog_version()
+    db.session.commit()
+    return {"generated": True, "generation_s": round(time.perf_counter() - start, 1)}
+
+
+def measure(client, make_request, n: int) -> dict:
+    for i in range(args.warmup):
+        make_request(client, i)
+    wall, queries, statuses = [], [], {}
+    for i in range(args.warmup, args.warmup + n):
+        t0 = time.perf_counter()
+        response = make_request(client, i)
+        wall.append((time.perf_counter() - t0) * 1000)
+        queries.append(int(response.headers.get("X-DB-Queries", 0)))
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    cuts = statistics.quantiles(wall, n=100, method="inclusive") if len(wall) > 1 else wall * 99
+    return {
+        "requests": n,
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+        "mean_ms": round(statistics.fmean(wall), 3),
+        "queries_mean": round(statistics.fmean(queries), 2),
+        "queries_max": max(queries),
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+
+def routes(rng, n_books: int, pages: int) -> dict:
+    """route -> hàm (client, i) -> response. Tham số thay đổi theo i để không đo mãi một trang."""
+    cursor = {"next": ""}
+    borrowed = []
+
+    def api_books_cursor(client, i):
+        response = client.get(f"/api/books?limit=20&cursor={cursor['next']}")
+        cursor["next"] = response.get_json().get("next_cursor") or ""
+        return response
+
+    def borrow(client, i):
+        book_id = rng.randint(1, n_books)
+        return client.post("/loans", data={"book_id": book_id, "borrower": f"Khách đo tải {i}"})
+
+    def give_back(client, i):
+        return client.post(f"/loans/{borrowed[i % len(borrowed)]}/return")
+
+    def collect_open_loans():
+        with app.app_context():
+            borrowed.extend(db.session.scalars(
+                db.select(Loan.id).where(Loan.returned_at.is_(None)).order_by(Loan.id.desc())
+                .limit(args.requests + args.warmup)
+            ))
+
+    return {
+        "GET /": lambda c, i: c.get("/"),
+        "GET /books": lambda c, i: c.get(f"/books?page={rng.randint(1, pages)}"),
+        "GET /books?q=": lambda c, i: c.get(f"/books?q={QUERIES[i % len(QUERIES)]}"),
+        "GET /api/books": lambda c, i: c.get(f"/api/books?limit=20&page={rng.randint(1, pages)}"),
+        "GET /api/books?q=": lambda c, i: c.get(f"/api/books?limit=20&q={QUERIES[i % len(QUERIES)]}"),
+        "GET /api/books?cursor=": api_books_cursor,
+        "GET /api/books?facets=": lambda c, i: c.get(
+            f"/api/books?limit=20&facets=genre,year&q={QUERIES[i % len(QUERIES)]}"),
+        "GET /api/books/suggest": lambda c, i: c.get(f"/api/books/suggest?q={QUERIES[i % len(QUERIES)][:4]}"),
+        "GET /loans": lambda c, i: c.get("/loans"),
+        "GET /api/loans": lambda c, i: c.get("/api/loans?limit=20"),
+        "GET /api/loans/history": lambda c, i: c.get("/api/loans/history?limit=20"),
+        "POST /loans (mượn)": borrow,
+        "POST /loans/<id>/return": (collect_open_loans, give_back),
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    rng = random.Random(args.seed)
+    with app.app_context():
+        existing = db.session.query(Book.id).limit(1).first() is not None
+        dataset = {"generated": False} if existing else generate(rng)
+        dataset.update(
+            books=db.session.query(db.func.count(Book.id)).scalar(),
+            loans=db.session.query(db.func.count(Loan.id)).scalar(),
+            open_loans=db.session.query(db.func.count(Loan.id)).filter(Loan.returned_at.is_(None)).scalar(),
+        )
+    dataset["peak_rss_mb_after_load"] = peak_rss_mb()
+
+    # không giữ cookie: flash của các lượt mượn/trả không dồn vào session
+    client = app.test_client(use_cookies=False)
+    pages = max(dataset["books"] // 20, 1)
+    results = {}
+    for name, make_request in routes(rng, max(dataset["books"], 1), pages).items():
+        if isinstance(make_request, tuple):
+            prepare, make_request = make_request
+            prepare()
+        results[name] = measure(client, make_request, args.requests)
+        print(f"  {name:<28} p50 {results[name]['p50_ms']:>9.2f} ms  p95 {results[name]['p95_ms']:>9.2f} ms  "
+              f"{results[name]['queries_mean']:>5} SQL", file=sys.stderr)
+
+    report = {
+        "revision": git_revision(),
+        "config": {
+            "requests": args.requests, "profile": args.profile, "cache": args.cache, "seed": args.seed,
+            "json": type(app.json).__name__,
+        },
+        "dataset": dataset,
+        "routes": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    body = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(body + "\n")
+    else:
+        print(body)
+
+
+if __name__ == "__main__":
+    main()
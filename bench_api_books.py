@@ -0,0 +1,113 @@
+"""
+Micro-benchmark cho /api/books ở limit=100
+So sánh CPU mỗi request giữa cách cũ (nạp entity Book đầy đủ, tự dựng dict, JSON chuẩn)
+và đường hiện tại (chỉ SELECT cột cần, trả về row, orjson nếu có). Cache response bị tắt.
+
+Chạy: python bench_api_books.py --books 5000 --requests 300
+(dùng DB tạm, không đụng instance/library.db)
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir.name, 'bench.db')}"
+
+from flask import request  # noqa: E402
+
+from app import app  # noqa: E402  (phải import sau khi đặt DATABASE_URL)
+from json_provider import orjson  # noqa: E402
+from models import db, Book  # noqa: E402
+
+app.extensions.pop("response_cache", None)
+
+
+@app.route("/bench/legacy-books")
+def legacy_api_books():
+    """Bản sao /api/books trước khi tối ưu (đường "trước").
+
+    Sắp theo title_sort như /api/books (ix_book_title_sort) để hai đường cùng đi chỉ mục:
+    ix_book_title cũ đã bị bỏ, sắp theo title sẽ phải sort cả bảng và thổi phồng chênh lệch.
+    """
+    page = request.args.get("page", 1, type=int)
+    limit = request.args.get("limit", 5, type=int)
+    pagination = Book.query.order_by(Book.title_sort, Book.id).paginate(page=page, per_page=limit, error_out=False)
+    body = {
+        "page": pagination.page,
+        "total_pages": pagination.pages,
+        "total_items": pagination.total,
+        "results": [
+            {"id": b.id, "title": b.title, "author": b.author, "genre": b.genre, "year": b.year}
+            for b in pagination.items
+        ],
+    }
+    return app.response_class(json.dumps(body, sort_keys=True) + "\n", mimetype="application/json")
+
+
+def seed(n: int) -> None:
+    with app.app_context():
+        db.session.execute(db.insert(Book), [
+            {
+                "title": f"Sách số {i:06d} - Lập trình và dữ liệu",
+                "author": f"Tác giả {i % 700}",
+                "genre": f"Thể loại {i % 40}",
+                "year": 1980 + i % 45,
+                "total_copies": 3,
+                "available_copies": 3,
+            }
+            for i in range(n)
+        ])
+        db.session.commit()
+
+
+def measure(client, url: str, requests: int, pages: int) -> dict:
+    cpu, wall = [], []
+    for i in range(requests):
+        page_url = f"{url}&page={i % pages + 1}"
+        c0, w0 = time.process_time(), time.perf_counter()
+        response = client.get(page_url)
+        cpu.append(time.process_time() - c0)
+        wall.append(time.perf_counter() - w0)
+        assert response.status_code == 200, response.status_code
+    return {
+        "cpu_ms_mean": round(statistics.fmean(cpu) * 1000, 3),
+        "cpu_ms_p50": round(statistics.median(cpu) * 1000, 3),
+        "wall_ms_p50": round(statistics.median(wall) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    seed(args.books)
+    pages = max(args.books // args.limit, 1)
+    client = app.test_client()
+    cases = {
+        "trước (entity + json)": f"/bench/legacy-books?limit={args.limit}",
+        "sau (row + fast json)": f"/api/books?limit={args.limit}",
+        "sau, fields=id,title": f"/api/books?limit={args.limit}&fields=id,title",
+        "sau, count=none": f"/api/books?limit={args.limit}&count=none",
+    }
+    for url in cases.values():  # làm nóng
+        measure(client, url, 10, pages)
+
+    results = {name: measure(client, url, args.requests, pages) for name, url in cases.items()}
+    base = results["trước (entity + json)"]["cpu_ms_mean"]
+    print("=" * 72)
+    print(f"/api/books limit={args.limit}, {args.books} sách, encoder: {'orjson' if orjson else 'json chuẩn'}")
+    print(f"{'trường hợp':<26} {'CPU ms (tb)':>12} {'CPU ms p50':>12} {'wall p50':>10} {'x':>7}")
+    for name, r in results.items():
+        print(f"{name:<26} {r['cpu_ms_mean']:>12} {r['cpu_ms_p50']:>12} {r['wall_ms_p50']:>10} "
+              f"{base / r['cpu_ms_mean']:>7.2f}")
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
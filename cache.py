@@ -0,0 +1,145 @@
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, request, session
+
+from models import catalog_version
+
+
+class LRUCache:
+    """Dict giới hạn kích thước, loại bỏ phần tử ít dùng gần đây nhất (an toàn đa luồng)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def init_cache(app) -> None:
+    size = app.config.get("RESPONSE_CACHE_SIZE", 0)
+    if size > 0:
+        app.extensions["response_cache"] = LRUCache(size)
+    facet_size = app.config.get("FACET_CACHE_SIZE", 0)
+    if facet_size > 0:
+        app.extensions["facet_cache"] = LRUCache(facet_size)
+
+
+def request_key(view_args=None) -> tuple:
+    """Khoá theo route + query string đã chuẩn hoá (thứ tự tham số không quan trọng)."""
+    return (
+        request.endpoint,
+        tuple(sorted((view_args or {}).items())),
+        tuple(sorted(request.args.items(multi=True))),
+    )
+
+
+def vary_by_day(view):
+    """Đánh dấu view đổi theo ngày (UTC) dù danh mục không đổi, vd. bảng xếp hạng tuần/tháng.
+
+    Đặt dưới cùng (sát def): cached_view/conditional_view thêm ngày hiện tại vào khoá và ETag.
+    """
+    view.vary_by_day = True
+    return view
+
+
+def _validity(view):
+    """(khoá phiên bản, thời điểm đổi gần nhất) của dữ liệu mà view trả về."""
+    version = catalog_version()
+    if not getattr(view, "vary_by_day", False):
+        return (version.version,), version.updated_at
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return (version.version, today.date().isoformat()), max(version.updated_at, today)
+
+
+def cached_view(view):
+    """Cache response 200 của route GET theo (route, tham số, catalog version[, ngày nếu vary_by_day]).
+
+    Mọi route ghi đều bump catalog version nên entry cũ tự hết hiệu lực.
+    Bỏ qua cache khi phiên còn flash message chưa hiển thị (HTML khác nhau).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions.get("response_cache")
+        if cache is None or session.get("_flashes"):
+            return view(*args, **kwargs)
+
+        key = request_key(kwargs) + _validity(view)[0]
+        hit = cache.get(key)
+        if hit is not None:
+            body, mimetype = hit
+            return current_app.response_class(body, mimetype=mimetype)
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            cache.set(key, (response.get_data(), response.mimetype))
+        return response
+
+    return wrapper
+
+
+def conditional_view(view):
+    """Conditional GET: ETag mạnh từ (route, tham số, catalog version[, ngày]), Last-Modified từ
+    catalog_version.updated_at (không sớm hơn 0h UTC hôm nay với view vary_by_day). Client gửi If-None-Match/If-Modified-Since khớp thì trả 304
+    ngay, chỉ tốn một lần đọc dòng version (không chạy truy vấn danh mục nào).
+
+    Last-Modified chỉ chính xác tới giây: hai version trong cùng một giây có cùng giá trị. Vì vậy
+    chỉ gửi (và chỉ tin If-Modified-Since) khi giây của version hiện tại đã trôi qua; trước đó
+    client chỉ dùng được ETag.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if session.get("_flashes"):
+            return view(*args, **kwargs)
+
+        version_key, updated_at = _validity(view)
+        etag = hashlib.sha1(repr(request_key(kwargs) + version_key).encode()).hexdigest()[:24]
+        last_modified = updated_at.replace(microsecond=0, tzinfo=timezone.utc)
+        # một lần ghi sau thời điểm này chắc chắn có Last-Modified lớn hơn
+        settled = datetime.utcnow() >= updated_at.replace(microsecond=0) + timedelta(seconds=1)
+
+        # If-None-Match được ưu tiên hơn If-Modified-Since (RFC 9110)
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        elif request.if_modified_since:
+            not_modified = settled and last_modified <= request.if_modified_since
+        else:
+            not_modified = False
+
+        if not_modified:
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        if settled:
+            response.last_modified = last_modified
+        # được lưu nhưng phải hỏi lại server (rẻ nhờ 304) trước mỗi lần dùng
+        response.cache_control.no_cache = True
+        return response
+
+    return wrapper
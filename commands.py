@@ -0,0 +1,307 @@
+import csv
+import json
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+import click
+import sqlalchemy as sa
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import db, Book, Loan, LoanArchive, bump_catalog_version, dialect_insert
+from export import parse_since
+from search import fts_enabled, rebuild_search_index
+
+# Số dòng lỗi tối đa được in ra khi nhập
+MAX_REPORTED_ERRORS = 5
+
+
+def register_commands(app) -> None:
+    app.cli.add_command(import_books)
+    app.cli.add_command(archive_loans)
+    app.cli.add_command(build_recommendations)
+    app.cli.add_command(reconcile_inventory)
+    app.cli.add_command(rebuild_search_index_command)
+
+
+@click.command("import-books")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]),
+              help="Mặc định đoán theo đuôi file (.jsonl/.ndjson -> jsonl).")
+@click.option("--batch-size", default=5000, show_default=True, type=click.IntRange(min=1))
+@click.option("--key", type=click.Choice(["isbn", "id", "none"]), default="isbn", show_default=True,
+              help="Cột dùng để upsert; dòng trùng khoá được cập nhật thay vì thêm mới.")
+@click.option("--defer-indexes", is_flag=True,
+              help="Bỏ các chỉ mục phụ của bảng book trong lúc nạp, tạo lại một lần ở cuối.")
+@with_appcontext
+def import_books(path, fmt, batch_size, key, defer_indexes):
+    """Nạp danh mục sách từ CSV/JSONL theo lô (stream, không đọc cả file vào bộ nhớ).
+
+    Cột: title, author, genre, year, total_copies, available_copies, isbn, id.
+    """
+    fmt = fmt or ("jsonl" if path.suffix in (".jsonl", ".ndjson") else "csv")
+    deferred = drop_secondary_indexes(Book.__table__) if defer_indexes else []
+
+    loaded = skipped = 0
+    start = time.perf_counter()
+    try:
+        rows = read_rows(path, fmt)
+        while batch := list(islice(rows, batch_size)):
+            good = []
+            for line_no, raw in batch:
+                try:
+                    good.append(normalize_book_row(raw))
+                except (KeyError, ValueError, TypeError, AttributeError) as exc:
+                    skipped += 1
+                    if skipped <= MAX_REPORTED_ERRORS:
+                        click.echo(f"  ⚠️ dòng {line_no}: bỏ qua ({exc!r})", err=True)
+            upsert_books(good, key)
+            db.session.commit()
+            loaded += len(good)
+            elapsed = time.perf_counter() - start
+            click.echo(f"  {loaded:>12,} dòng  {loaded / elapsed:>10,.0f} dòng/s")
+    finally:
+        if deferred:
+            click.echo(f"Tạo lại {len(deferred)} chỉ mục...")
+            with db.engine.begin() as conn:
+                for index in deferred:
+                    index.create(conn, checkfirst=True)
+
+    # Core insert không đi qua mapper event -> dựng lại chỉ mục tìm kiếm một lần
+    if fts_enabled():
+        click.echo("Dựng lại chỉ mục tìm kiếm...")
+        rebuild_search_index()
+    bump_catalog_version()
+    db.session.commit()
+
+    elapsed = time.perf_counter() - start
+    click.echo(f"✅ Đã nạp {loaded:,} dòng ({skipped:,} dòng lỗi) trong {elapsed:.1f}s "
+               f"({loaded / max(elapsed, 1e-9):,.0f} dòng/s)")
+
+
+@click.command("archive-loans")
+@click.option("--older-than-days", type=click.IntRange(min=0),
+              help="Mặc định LOAN_ARCHIVE_AFTER_DAYS (365).")
+@click.option("--batch-size", default=5000, show_default=True, type=click.IntRange(min=1))
+@with_appcontext
+def archive_loans(older_than_days, batch_size):
+    """Chuyển phiếu đã trả lâu ngày từ loan sang loan_archive theo lô.
+
+    Mỗi lô: chép sang loan_archive (bỏ qua id đã có) và commit, rồi mới xoá khỏi loan và commit.
+    Dừng giữa chừng thì chạy lại được, không mất hay nhân đôi phiếu.
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config["LOAN_ARCHIVE_AFTER_DAYS"]
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    columns = (Loan.id, Loan.book_id, Loan.borrower, Loan.borrower_id, Loan.borrowed_at, Loan.returned_at)
+    copy = dialect_insert(LoanArchive, "archive").on_conflict_do_nothing(index_elements=["id"])
+
+    moved = 0
+    start = time.perf_counter()
+    while True:
+        # quét theo ix_loan_returned_borrowed: chỉ chạm các phiếu đủ tuổi
+        rows = db.session.execute(
+            sa.select(*columns).where(Loan.returned_at < cutoff).limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+        now = datetime.utcnow()
+        db.session.execute(copy, [{**row, "archived_at": now} for row in rows])
+        db.session.commit()
+        db.session.execute(sa.delete(Loan).where(Loan.id.in_([row["id"] for row in rows])))
+        db.session.commit()
+        moved += len(rows)
+        click.echo(f"  {moved:>12,} phiếu")
+
+    if moved:
+        bump_catalog_version()
+        db.session.commit()
+    click.echo(f"✅ Đã lưu trữ {moved:,} phiếu trả trước {cutoff:%Y-%m-%d} "
+               f"trong {time.perf_counter() - start:.1f}s")
+
+
+@click.command("build-recommendations")
+@click.option("--top-k", default=10, show_default=True, type=click.IntRange(min=1))
+@click.option("--min-common", default=1, show_default=True, type=click.IntRange(min=1),
+              help="Số người mượn chung tối thiểu để hai sách được coi là liên quan.")
+@click.option("--since", "since_text", metavar="ISO8601",
+              help="Chỉ tính lại sách của người mượn có phiếu từ thời điểm này (mặc định: tính lại hết).")
+@with_appcontext
+def build_recommendations(top_k, min_common, since_text):
+    """Tính bảng book_related ("người mượn sách này cũng mượn") từ lịch sử mượn.
+
+    Cần numpy và scipy (pip install numpy scipy); chỉ lệnh này dùng tới, app web thì không.
+    """
+    try:
+        since = parse_since(since_text)
+    except ValueError:
+        raise click.BadParameter("phải theo định dạng ISO 8601", param_hint="--since")
+    try:
+        from recommendations import build_related
+        start = time.perf_counter()
+        stats = build_related(top_k, min_common, since)
+    except ImportError as exc:
+        raise click.ClickException(f"Thiếu thư viện {exc.name}: pip install numpy scipy")
+    bump_catalog_version()
+    db.session.commit()
+    click.echo(f"✅ Đã tính {stats['books']:,} sách, ghi {stats['rows']:,} dòng "
+               f"trong {time.perf_counter() - start:.1f}s")
+
+
+@click.command("reconcile-inventory")
+@click.option("--fix", is_flag=True, help="Ghi lại available_copies cho mọi sách bị lệch (một câu UPDATE).")
+@click.option("--show", default=20, show_default=True, type=click.IntRange(min=0),
+              help="Số sách lệch được in ra làm ví dụ.")
+@with_appcontext
+def reconcile_inventory(fix, show):
+    """Đối chiếu available_copies với total_copies - số phiếu đang mở cho toàn bộ sách.
+
+    Số câu lệnh không phụ thuộc số sách: một GROUP BY phiếu mở LEFT JOIN book để báo cáo,
+    một UPDATE với subquery tương quan (seek ix_loan_book_returned) để sửa.
+    """
+    open_loans = (
+        sa.select(Loan.book_id, sa.func.count().label("open_loans"))
+        .where(Loan.returned_at.is_(None))
+        .group_by(Loan.book_id)
+        .subquery()
+    )
+    out = sa.func.coalesce(open_loans.c.open_loans, 0)
+    # nhiều phiếu mở hơn số bản (vd. giảm total_copies khi sách đang mượn) -> còn 0 bản
+    expected = sa.case((Book.total_copies - out < 0, 0), else_=Book.total_copies - out)
+    mismatched = (
+        sa.select(Book.id, Book.title, Book.total_copies, Book.available_copies, out.label("open_loans"),
+                  expected.label("expected"))
+        .outerjoin(open_loans, open_loans.c.book_id == Book.id)
+        .where(Book.available_copies != expected)
+    )
+
+    diff = mismatched.subquery()
+    summary = db.session.execute(
+        sa.select(sa.func.count(), sa.func.coalesce(sa.func.sum(sa.func.abs(diff.c.available_copies - diff.c.expected)), 0))
+    ).one()
+    if show and summary[0]:
+        click.echo(f"{'id':>10}  {'tổng':>5}  {'đang mượn':>9}  {'ghi nhận':>8}  {'thực tế':>7}  tên")
+        for row in db.session.execute(mismatched.order_by(Book.id).limit(show)):
+            click.echo(f"{row.id:>10}  {row.total_copies:>5}  {row.open_loans:>9}  {row.available_copies:>8}  "
+                       f"{row.expected:>7}  {row.title}")
+    click.echo(f"{summary[0]:,} sách lệch tồn kho (tổng chênh {summary[1]:,} bản)")
+    if not fix or not summary[0]:
+        return
+
+    open_count = (
+        sa.select(sa.func.count())
+        .where(Loan.book_id == Book.id, Loan.returned_at.is_(None))
+        .correlate(Book)
+        .scalar_subquery()
+    )
+    actual = sa.case((Book.total_copies - open_count < 0, 0), else_=Book.total_copies - open_count)
+    fixed = db.session.execute(
+        sa.update(Book).where(Book.available_copies != actual).values(available_copies=actual),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    bump_catalog_version()
+    db.session.commit()
+    click.echo(f"✅ Đã sửa {fixed:,} sách")
+
+
+@click.command("rebuild-search-index")
+@with_appcontext
+def rebuild_search_index_command():
+    """Dựng lại toàn bộ chỉ mục tìm kiếm FTS5 từ bảng book (sau khi sửa dữ liệu ngoài ứng dụng)."""
+    if not fts_enabled():
+        raise click.ClickException("SQLite không hỗ trợ FTS5 (hoặc không dùng SQLite): tìm kiếm dùng ILIKE")
+    start = time.perf_counter()
+    rebuild_search_index()
+    click.echo(f"✅ Đã dựng lại chỉ mục tìm kiếm trong {time.perf_counter() - start:.1f}s")
+
+
+def read_rows(path: Path, fmt: str):
+    """Sinh (số dòng, dict) từ file, đọc tuần tự."""
+    with path.open(encoding="utf-8-sig", newline="") as f:
+        if fmt == "csv":
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                yield line_no, row
+        else:
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        yield line_no, json.loads(line)
+                    except ValueError as exc:
+                        yield line_no, exc
+
+
+def normalize_book_row(raw) -> dict:
+    if isinstance(raw, Exception):
+        raise raw
+    title, author = raw["title"].strip(), raw["author"].strip()
+    if not title or not author:
+        raise ValueError("thiếu title/author")
+    total = int(raw.get("total_copies") or 1)
+    available = raw.get("available_copies")
+    return {
+        "id": _int_or_none(raw.get("id")),
+        "isbn": (str(raw.get("isbn") or "")).strip() or None,
+        "title": title,
+        "author": author,
+        "genre": (raw.get("genre") or "").strip() or None,
+        "year": _int_or_none(raw.get("year")),
+        "total_copies": total,
+        "available_copies": total if available in (None, "") else int(available),
+    }
+
+
+def upsert_books(rows: list[dict], key: str) -> None:
+    """Ghi một lô bằng executemany; trùng khoá thì cập nhật.
+
+    Khi cập nhật, available_copies được dịch theo chênh lệch total_copies (như edit_book)
+    thay vì ghi đè, để không làm mất số bản đang cho mượn.
+    """
+    table = Book.__table__
+    if key == "none":
+        keyed, plain = [], rows
+    else:
+        keyed = [r for r in rows if r[key] is not None]
+        plain = [r for r in rows if r[key] is None]
+
+    if plain:
+        db.session.execute(sa.insert(table), [_without_id(r) for r in plain])
+    if keyed:
+        if key == "isbn":
+            keyed = [_without_id(r) for r in keyed]
+        stmt = dialect_insert(table)
+        shifted = table.c.available_copies + stmt.excluded.total_copies - table.c.total_copies
+        updates = {
+            "title": stmt.excluded.title,
+            "title_sort": stmt.excluded.title_sort,
+            "author": stmt.excluded.author,
+            "genre": stmt.excluded.genre,
+            "year": stmt.excluded.year,
+            "total_copies": stmt.excluded.total_copies,
+            "available_copies": sa.case((shifted < 0, 0), else_=shifted),
+            # ON CONFLICT DO UPDATE không tự áp onupdate của cột
+            "updated_at": datetime.utcnow(),
+        }
+        if key == "id":
+            updates["isbn"] = stmt.excluded.isbn
+        db.session.execute(stmt.on_conflict_do_update(index_elements=[key], set_=updates), keyed)
+
+
+def drop_secondary_indexes(table) -> list:
+    """Xoá các chỉ mục không unique (unique cần cho upsert); trả về để tạo lại sau."""
+    dropped = [index for index in table.indexes if not index.unique]
+    with db.engine.begin() as conn:
+        for index in dropped:
+            index.drop(conn, checkfirst=True)
+    return dropped
+
+
+def _without_id(row: dict) -> dict:
+    return {k: v for k, v in row.items() if k != "id"}
+
+
+def _int_or_none(value):
+    if value in (None, ""):
+        return None
+    return int(value)
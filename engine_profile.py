@@ -0,0 +1,128 @@
+import os
+from urllib.parse import quote
+
+import sqlalchemy as sa
+
+from routing import READ_BIND_KEY
+
+# PRAGMA áp dụng cho mỗi connection SQLite mới, theo profile (DB_PROFILE)
+SQLITE_PROFILES = {
+    # giữ nguyên mặc định của SQLite/SQLAlchemy (rollback journal, không busy timeout)
+    "default": {},
+    # nhiều worker gunicorn: WAL để reader không chờ writer, chờ khoá thay vì báo "database is locked"
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,              # ms
+        "mmap_size": 256 * 1024 * 1024,    # bytes
+        "cache_size": -64 * 1024,          # số âm = KiB -> 64 MiB mỗi connection
+        "temp_store": "MEMORY",
+    },
+}
+
+# Biến môi trường ghi đè từng PRAGMA, vd. SQLITE_BUSY_TIMEOUT=10000
+_PRAGMA_ENV = {
+    "journal_mode": "SQLITE_JOURNAL_MODE",
+    "synchronous": "SQLITE_SYNCHRONOUS",
+    "busy_timeout": "SQLITE_BUSY_TIMEOUT",
+    "mmap_size": "SQLITE_MMAP_SIZE",
+    "cache_size": "SQLITE_CACHE_SIZE",
+    "temp_store": "SQLITE_TEMP_STORE",
+}
+
+# Biến môi trường -> tham số pool của create_engine
+_POOL_ENV = {
+    "pool_size": "DB_POOL_SIZE",
+    "max_overflow": "DB_MAX_OVERFLOW",
+    "pool_timeout": "DB_POOL_TIMEOUT",
+    "pool_recycle": "DB_POOL_RECYCLE",
+}
+# Pool riêng của engine chỉ đọc (mặc định như primary)
+_READ_POOL_ENV = {
+    "pool_size": "DB_READ_POOL_SIZE",
+    "max_overflow": "DB_READ_MAX_OVERFLOW",
+}
+
+
+def configure_engine(app, default_uri: str) -> None:
+    """Đọc URL/profile/pool từ môi trường vào app.config (gọi trước db.init_app)."""
+    uri = os.environ.get("DATABASE_URL", default_uri)
+    profile = os.environ.get("DB_PROFILE", "default")
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"DB_PROFILE phải là một trong {', '.join(SQLITE_PROFILES)}")
+
+    # Bảng loan_archive: mặc định cùng DB, hoặc file/DB riêng qua LOAN_ARCHIVE_URL
+    archive_uri = os.environ.get("LOAN_ARCHIVE_URL", uri)
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    app.config["SQLALCHEMY_BINDS"] = {"archive": archive_uri}
+    app.config["DB_PROFILE"] = profile
+    app.config["SQLITE_PRAGMAS"] = sqlite_pragmas(profile) if _is_file_sqlite(uri) else {}
+    app.config["SQLITE_ARCHIVE_PRAGMAS"] = sqlite_pragmas(profile) if _is_file_sqlite(archive_uri) else {}
+
+    options = {}
+    if profile == "production" and not uri.startswith("sqlite"):
+        # DB server: bỏ connection chết sau failover, tái tạo trước timeout phía server
+        options.update(pool_pre_ping=True, pool_recycle=1800)
+    if not _is_memory_sqlite(uri):
+        for option, env in _POOL_ENV.items():
+            if os.environ.get(env):
+                options[option] = int(os.environ[env])
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+    # Engine đọc cho request GET/HEAD (routing.RoutingSession): replica qua DATABASE_READ_URL,
+    # không thì SQLite file chạy WAL được mở thêm ở mode=ro (reader không xếp hàng sau writer)
+    read_uri = os.environ.get("DATABASE_READ_URL") or _sqlite_read_only_uri(uri, app.config["SQLITE_PRAGMAS"])
+    app.config["SQLITE_READ_PRAGMAS"] = {}
+    if read_uri:
+        read_options = dict(options)   # bind không nhận SQLALCHEMY_ENGINE_OPTIONS
+        for option, env in _READ_POOL_ENV.items():
+            if os.environ.get(env):
+                read_options[option] = int(os.environ[env])
+        app.config["SQLALCHEMY_BINDS"][READ_BIND_KEY] = {"url": read_uri, **read_options}
+        if _is_file_sqlite(read_uri):
+            # connection chỉ đọc không đổi được journal_mode (chế độ WAL nằm trong file DB)
+            pragmas = sqlite_pragmas(profile)
+            pragmas.pop("journal_mode", None)
+            app.config["SQLITE_READ_PRAGMAS"] = pragmas
+
+
+def sqlite_pragmas(profile: str) -> dict:
+    pragmas = dict(SQLITE_PROFILES[profile])
+    for pragma, env in _PRAGMA_ENV.items():
+        if os.environ.get(env):
+            pragmas[pragma] = os.environ[env]
+    return pragmas
+
+
+def install_sqlite_pragmas(engine, pragmas: dict) -> None:
+    """Áp PRAGMA trên mỗi connection mới của engine (gọi trước khi engine mở connection đầu)."""
+    if not pragmas:
+        return
+
+    @sa.event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
+
+def _sqlite_read_only_uri(uri: str, pragmas: dict) -> str | None:
+    """sqlite:///path.db -> sqlite:///file:path.db?mode=ro&uri=true, chỉ khi DB chạy WAL."""
+    if not _is_file_sqlite(uri) or str(pragmas.get("journal_mode", "")).upper() != "WAL":
+        return None
+    url = sa.engine.make_url(uri)
+    if url.query.get("uri"):
+        return None   # URI SQLite tự cấu hình: để nguyên, không đoán
+    return url.set(
+        database=f"file:{quote(url.database)}", query={**url.query, "mode": "ro", "uri": "true"}
+    ).render_as_string(hide_password=False)
+
+
+def _is_memory_sqlite(uri: str) -> bool:
+    return uri.startswith("sqlite") and (uri in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in uri)
+
+
+def _is_file_sqlite(uri: str) -> bool:
+    return uri.startswith("sqlite") and not _is_memory_sqlite(uri)
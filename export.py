@@ -0,0 +1,70 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from flask import Response, stream_with_context
+
+from models import db
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+# Số dòng lấy từ cursor mỗi lần, cũng là số dòng gộp vào một chunk HTTP
+EXPORT_CHUNK = 1000
+
+
+def stream_export(stmt, fmt: str, filename: str) -> Response:
+    """Stream kết quả `stmt` (Core select, hoặc list các select cùng cột nối tiếp nhau, vd. loan
+    rồi loan_archive) dưới dạng NDJSON/CSV.
+
+    Dùng yield_per nên chỉ giữ tối đa EXPORT_CHUNK dòng trong bộ nhớ dù bảng lớn cỡ nào.
+    """
+    stmts = stmt if isinstance(stmt, list) else [stmt]
+
+    def generate():
+        for i, part in enumerate(stmts):
+            result = db.session.execute(part.execution_options(yield_per=EXPORT_CHUNK))
+            columns = list(result.keys())
+            if fmt == "csv" and i == 0:
+                yield _csv_chunk([columns])
+            for rows in result.partitions():
+                if fmt == "csv":
+                    yield _csv_chunk([_csv_value(v) for v in row] for row in rows)
+                else:
+                    yield "".join(
+                        json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + "\n"
+                        for row in rows
+                    )
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"},
+    )
+
+
+def parse_since(value: str | None) -> datetime | None:
+    """?since=2024-05-01 hoặc 2024-05-01T08:30:00 (UTC, như các cột thời gian trong DB)."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def _csv_chunk(rows) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue()
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} không chuyển sang JSON được")
@@ -0,0 +1,60 @@
+from collections import Counter
+
+from flask import current_app
+
+from models import db, Book, catalog_version
+from search import search_books
+
+FACETS = ("genre", "year")
+DEFAULT_YEAR_BUCKET = 10
+
+
+def compute_facets(names, search: str, year_bucket: int = DEFAULT_YEAR_BUCKET) -> dict:
+    """Đếm theo thể loại / khoảng năm trên tập đã lọc bằng MỘT câu GROUP BY.
+
+    Kết quả được cache theo (từ khoá, facet, khoảng năm, catalog version) nên các truy vấn
+    phổ biến chỉ tốn một lần tính cho tới lần ghi kế tiếp.
+    """
+    names = tuple(sorted(set(names)))
+    cache = current_app.extensions.get("facet_cache")
+    key = (search.strip(), names, year_bucket, catalog_version().version)
+    if cache is not None:
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
+
+    columns = []
+    if "genre" in names:
+        columns.append(Book.genre.label("genre"))
+    if "year" in names:
+        columns.append(((Book.year // year_bucket) * year_bucket).label("year"))
+    query = db.session.query(*columns, db.func.count().label("n"))
+    if search:
+        query = search_books(query, search)
+    rows = query.order_by(None).group_by(*columns).all()
+
+    # Cộng dồn các nhóm (genre, năm) thành từng facet riêng
+    counts = {name: Counter() for name in names}
+    for row in rows:
+        for name in names:
+            counts[name][getattr(row, name)] += row.n
+
+    result = {}
+    if "genre" in counts:
+        result["genre"] = [
+            {"value": value, "count": n}
+            for value, n in sorted(counts["genre"].items(), key=lambda item: (-item[1], item[0] or ""))
+        ]
+    if "year" in counts:
+        result["year"] = [
+            {
+                "from": start,
+                "to": None if start is None else start + year_bucket - 1,
+                "count": n,
+            }
+            for start, n in sorted(counts["year"].items(), key=lambda item: (item[0] is None, item[0] or 0))
+        ]
+
+    if cache is not None:
+        cache.set(key, result)
+    return result
@@ -0,0 +1,35 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson là tuỳ chọn: không có thì dùng json của thư viện chuẩn
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Mã hoá JSON bằng orjson (nhanh hơn json chuẩn nhiều lần với danh sách lớn).
+
+    datetime/date vẫn đi qua `default` của Flask để định dạng giống DefaultJSONProvider.
+    """
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs:
+            # tham số riêng của json chuẩn (indent, sort_keys, ...) -> để json chuẩn xử lý
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_json(app) -> None:
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
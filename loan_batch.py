@@ -0,0 +1,189 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from models import db, Book, Loan, borrower_ids_for, bump_catalog_version, lock_borrowers
+from popularity import record_borrows
+from textnorm import name_key
+
+# Số thao tác tối đa trong một lô
+BATCH_MAX_OPERATIONS = 200
+
+
+class BatchConflict(Exception):
+    """Dữ liệu đổi giữa lúc kiểm tra và lúc ghi (request khác chen vào); cả lô đã được huỷ."""
+
+
+def apply_loan_batch(operations: list, atomic: bool = False, max_active: int = 0) -> tuple[list[dict], int]:
+    """Mượn/trả nhiều cuốn trong MỘT transaction (một lần commit).
+
+    Kiểm tra bằng vài truy vấn theo tập (IN / GROUP BY) cho cả lô, rồi ghi: một UPDATE cho
+    mọi phiếu trả, một UPDATE tồn kho có điều kiện cho mỗi sách, một INSERT nhiều dòng cho phiếu
+    mới. Thao tác trả được xử lý trước nên bản vừa trả có thể mượn lại ngay trong cùng lô.
+
+    atomic=True: chỉ cần một thao tác lỗi là không ghi gì. Trả về (kết quả từng thao tác, số
+    thao tác đã ghi); ném BatchConflict nếu điều kiện đổi giữa chừng.
+    """
+    results = [None] * len(operations)
+    returns, borrows = {}, {}
+    for i, op in enumerate(operations):
+        error = _shape_error(op)
+        if error:
+            results[i] = _failed(i, op, error)
+        elif op["op"] == "return":
+            returns[i] = op
+        else:
+            borrows[i] = op
+
+    returned = _plan_returns(returns, results)
+    borrowed = _plan_borrows(borrows, returned, results, max_active)
+
+    if not returned and not borrowed or atomic and not all(r["ok"] for r in results):
+        db.session.rollback()
+        return results, 0
+    try:
+        _apply(returned, borrowed, results, max_active)
+    except BatchConflict:
+        db.session.rollback()
+        raise
+    bump_catalog_version()
+    db.session.commit()
+    return results, len(returned) + len(borrowed)
+
+
+def _shape_error(op) -> str | None:
+    if not isinstance(op, dict) or op.get("op") not in ("borrow", "return"):
+        return "op phải là borrow hoặc return"
+    key = "loan_id" if op["op"] == "return" else "book_id"
+    if not isinstance(op.get(key), int) or isinstance(op[key], bool) or op[key] < 1:
+        return f"{key} phải là số nguyên dương"
+    if op["op"] == "borrow":
+        borrower = op.get("borrower")
+        if not isinstance(borrower, str) or not borrower.strip() or len(borrower) > 120:
+            return "borrower phải là tên (1-120 ký tự)"
+    return None
+
+
+def _failed(i: int, op, error: str) -> dict:
+    return {"index": i, "op": op.get("op") if isinstance(op, dict) else None, "ok": False, "error": error}
+
+
+def _plan_returns(returns: dict, results: list) -> dict:
+    """{loan_id: (book_id, borrower_id)} của các phiếu trả hợp lệ (một SELECT ... IN)."""
+    loans = {}
+    if returns:
+        ids = {op["loan_id"] for op in returns.values()}
+        stmt = db.select(Loan.id, Loan.book_id, Loan.borrower_id, Loan.returned_at).where(Loan.id.in_(ids))
+        loans = {row.id: row for row in db.session.execute(stmt)}
+
+    accepted = {}
+    for i, op in returns.items():
+        loan = loans.get(op["loan_id"])
+        if loan is None:
+            results[i] = _failed(i, op, "không tìm thấy phiếu mượn")
+        elif loan.returned_at is not None or loan.id in accepted:
+            results[i] = _failed(i, op, "phiếu mượn đã được trả")
+        else:
+            accepted[loan.id] = (loan.book_id, loan.borrower_id)
+            results[i] = {"index": i, "op": "return", "ok": True, "loan_id": loan.id, "book_id": loan.book_id}
+    return accepted
+
+
+def _plan_borrows(borrows: dict, returned: dict, results: list, max_active: int) -> dict:
+    """{chỉ số thao tác: (book_id, borrower_id, tên)} của các lượt mượn được chấp nhận."""
+    if not borrows:
+        return {}
+    book_ids = {op["book_id"] for op in borrows.values()}
+    stock = dict(db.session.execute(
+        db.select(Book.id, Book.available_copies).where(Book.id.in_(book_ids))
+    ).all())
+    for book_id, _ in returned.values():
+        if book_id in stock:
+            stock[book_id] += 1
+
+    borrower_ids = borrower_ids_for(op["borrower"] for op in borrows.values())
+    if max_active:
+        # PostgreSQL: giữ khoá dòng borrower tới commit để lô khác không đếm chen vào
+        lock_borrowers(borrower_ids.values())
+    active = Counter(dict(db.session.execute(
+        db.select(Loan.borrower_id, db.func.count())
+        .where(Loan.borrower_id.in_(set(borrower_ids.values())), Loan.returned_at.is_(None))
+        .group_by(Loan.borrower_id)
+    ).all()))
+    active.subtract(borrower_id for _, borrower_id in returned.values())
+
+    accepted = {}
+    for i, op in borrows.items():
+        book_id, borrower_id = op["book_id"], borrower_ids[name_key(op["borrower"])]
+        if book_id not in stock:
+            results[i] = _failed(i, op, "không tìm thấy sách")
+        elif stock[book_id] <= 0:
+            results[i] = _failed(i, op, "hết sách để mượn")
+        elif max_active and active[borrower_id] >= max_active:
+            results[i] = _failed(i, op, f"mỗi người chỉ được mượn tối đa {max_active} cuốn cùng lúc")
+        else:
+            stock[book_id] -= 1
+            active[borrower_id] += 1
+            accepted[i] = (book_id, borrower_id, op["borrower"])
+            results[i] = {"index": i, "op": "borrow", "ok": True, "book_id": book_id, "loan_id": None}
+    return accepted
+
+
+def _apply(returned: dict, borrowed: dict, results: list, max_active: int) -> None:
+    now = datetime.utcnow()
+    if returned:
+        closed = db.session.execute(
+            db.update(Loan)
+            .where(Loan.id.in_(returned), Loan.returned_at.is_(None))
+            .values(returned_at=now)
+        ).rowcount
+        if closed != len(returned):
+            raise BatchConflict
+
+    # Tồn kho: một UPDATE có điều kiện cho mỗi sách (không bao giờ âm, không vượt total_copies)
+    delta = Counter(book_id for book_id, _ in returned.values())
+    delta.subtract(book_id for book_id, _, _ in borrowed.values())
+    for book_id, change in delta.items():
+        if change == 0:
+            continue
+        updated = db.session.execute(
+            db.update(Book)
+            .where(Book.id == book_id, Book.available_copies + change >= 0)
+            .values(available_copies=db.case(
+                (Book.available_copies + change > Book.total_copies, Book.total_copies),
+                else_=Book.available_copies + change,
+            ))
+        ).rowcount
+        if not updated:
+            raise BatchConflict
+
+    if borrowed:
+        # Một INSERT nhiều dòng. Thứ tự RETURNING không được đảm bảo nên ghép id theo
+        # (book_id, borrower_id); các phiếu trùng cặp này giống hệt nhau nên ghép cách nào cũng đúng
+        inserted = db.session.execute(
+            db.insert(Loan).returning(Loan.id, Loan.book_id, Loan.borrower_id),
+            [
+                {"book_id": book_id, "borrower": name, "borrower_id": borrower_id, "borrowed_at": now}
+                for book_id, borrower_id, name in borrowed.values()
+            ],
+        )
+        loan_ids = defaultdict(list)
+        for loan_id, book_id, borrower_id in inserted:
+            loan_ids[book_id, borrower_id].append(loan_id)
+        for i, (book_id, borrower_id, _) in borrowed.items():
+            results[i]["loan_id"] = loan_ids[book_id, borrower_id].pop()
+        record_borrows((book_id for book_id, _, _ in borrowed.values()), now)
+
+        # Kiểm tra lại giới hạn sau khi ghi: trên SQLite khoá ghi chỉ có từ câu ghi đầu tiên nên
+        # request khác có thể đã mượn chen giữa lúc đếm và lúc ghi (PostgreSQL đã khoá borrower)
+        if max_active:
+            over = db.session.execute(
+                db.select(Loan.borrower_id)
+                .where(
+                    Loan.borrower_id.in_({borrower_id for _, borrower_id, _ in borrowed.values()}),
+                    Loan.returned_at.is_(None),
+                )
+                .group_by(Loan.borrower_id)
+                .having(db.func.count() > max_active)
+            ).first()
+            if over is not None:
+                raise BatchConflict
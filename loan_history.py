@@ -0,0 +1,44 @@
+from models import db, Book, Loan, LoanArchive
+from pagination import merged_keyset_page
+
+
+def history_page(cursor: str | None, limit: int, borrower_id: int | None = None, book_id: int | None = None,
+                 status: str = "", order_by: str = "borrowed_at"):
+    """Lịch sử mượn (mới mượn trước) đọc từ loan và loan_archive như một bảng.
+
+    Mỗi bảng chỉ đọc một trang theo chỉ mục (borrowed_at, id) rồi trộn; tên sách lấy bằng một
+    truy vấn IN riêng vì loan_archive có thể nằm ở DB khác. status="active" chỉ đọc bảng loan
+    (loan_archive chỉ chứa phiếu đã trả). order_by="returned_at": mới trả trước (dùng với
+    status="returned"). Trả về (dòng, next_cursor, prev_cursor).
+    """
+    sources = []
+    for model in (Loan,) if status == "active" else (Loan, LoanArchive):
+        query = db.session.query(model.id, model.book_id, model.borrower, model.borrowed_at, model.returned_at)
+        if status == "active":
+            query = query.filter(model.returned_at.is_(None))
+        elif status == "returned":
+            query = query.filter(model.returned_at.is_not(None))
+        if borrower_id is not None:
+            query = query.filter(model.borrower_id == borrower_id)
+        if book_id is not None:
+            query = query.filter(model.book_id == book_id)
+        sources.append((query, (getattr(model, order_by), model.id)))
+
+    rows, next_cursor, prev_cursor = merged_keyset_page(sources, cursor, limit, descending=True)
+    titles = {}
+    if rows:
+        titles = dict(db.session.execute(
+            db.select(Book.id, Book.title).where(Book.id.in_({row.book_id for row in rows}))
+        ).all())
+    results = [
+        {
+            "id": row.id,
+            "book_id": row.book_id,
+            "title": titles.get(row.book_id),
+            "borrower": row.borrower,
+            "borrowed_at": row.borrowed_at,
+            "returned_at": row.returned_at,
+        }
+        for row in rows
+    ]
+    return results, next_cursor, prev_cursor
@@ -0,0 +1,227 @@
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from textnorm import name_key, sort_key
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có flock, các process không được khoá lẫn nhau
+    fcntl = None
+
+logger = logging.getLogger("library.migrations")
+
+# Bảng ghi lại các migration đã chạy (tách khỏi db.metadata để không phụ thuộc models)
+_metadata = sa.MetaData()
+schema_migrations = sa.Table(
+    "schema_migrations",
+    _metadata,
+    sa.Column("version", sa.Integer, primary_key=True),
+    sa.Column("description", sa.String(200), nullable=False),
+    sa.Column("applied_at", sa.DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+# Số dòng mỗi lượt khi backfill dữ liệu trong migration
+BACKFILL_BATCH = 5000
+# Khoá advisory (PostgreSQL) cho schema_lock
+SCHEMA_LOCK_KEY = 7310042
+
+
+def migration(version: int, description: str):
+    """Đăng ký một bước nâng cấp schema. Mỗi bước phải chạy lại được (idempotent):
+    db.create_all() đã tạo sẵn bảng/chỉ mục mới cho DB tạo từ đầu."""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+@contextmanager
+def schema_lock(engine):
+    """Khoá độc quyền giữa các process (vd. gunicorn -w 4 khởi động cùng lúc) quanh create_all + migrations.
+
+    SQLite: flock trên file <db>.migrate.lock cạnh file DB (pysqlite tự commit DDL nên không dựa
+    vào transaction được). PostgreSQL: advisory lock trên một connection riêng. Dialect khác hoặc
+    SQLite trong bộ nhớ: không khoá.
+    """
+    backend = engine.url.get_backend_name()
+    database = engine.url.database or ""
+    in_memory = database in ("", ":memory:") or engine.url.query.get("mode") == "memory"
+    if backend == "sqlite" and fcntl is not None and not in_memory:
+        path = database[5:] if database.startswith("file:") else database
+        with open(f"{path}.migrate.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    elif backend == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(sa.text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+            conn.commit()
+            try:
+                yield
+            finally:
+                conn.execute(sa.text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+                conn.commit()
+    else:
+        yield
+
+
+def run_migrations(engine) -> list[int]:
+    """Chạy các migration chưa áp dụng, theo thứ tự version. Trả về các version vừa chạy.
+
+    Gọi trong schema_lock: danh sách đã áp dụng được đọc sau khi có khoá. Mỗi bước chạy trong một
+    transaction, nhưng trên SQLite DDL (ALTER TABLE, CREATE INDEX) tự commit nên một bước không
+    nguyên tử; vì vậy bước phải chạy lại được.
+    """
+    _metadata.create_all(engine)
+    with engine.connect() as conn:
+        applied = set(conn.execute(sa.select(schema_migrations.c.version)).scalars())
+
+    ran = []
+    for version, description, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        logger.info("migration %s: %s", version, description)
+        try:
+            with engine.begin() as conn:
+                fn(conn)
+                conn.execute(schema_migrations.insert().values(
+                    version=version, description=description, applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # worker khác vừa chạy xong bước này (chỉ xảy ra khi không có schema_lock)
+            continue
+        ran.append(version)
+    return ran
+
+
+def add_column(conn, table: str, column: str, ddl: str) -> bool:
+    if column in {c["name"] for c in sa.inspect(conn).get_columns(table)}:
+        return False
+    conn.execute(sa.text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def create_index(conn, name: str, table: str, columns: str, where: str | None = None,
+                 unique: bool = False) -> None:
+    sql = f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+    if where:
+        sql += f" WHERE {where}"
+    conn.execute(sa.text(sql))
+
+
+@migration(1, "Thêm Book.genre, Book.year cho DB tạo trước khi có hai cột này")
+def _book_genre_year(conn):
+    add_column(conn, "book", "genre", "VARCHAR(100)")
+    add_column(conn, "book", "year", "INTEGER")
+
+
+@migration(2, "Chỉ mục cho sắp xếp theo tên sách và các truy vấn phiếu mượn")
+def _loan_and_title_indexes(conn):
+    create_index(conn, "ix_book_title", "book", "title")
+    create_index(conn, "ix_loan_book_returned", "loan", "book_id, returned_at")
+    create_index(conn, "ix_loan_borrowed_at", "loan", "borrowed_at")
+    create_index(conn, "ix_loan_open_borrowed_at", "loan", "borrowed_at", where="returned_at IS NULL")
+
+
+@migration(3, "Thêm Book.isbn (unique) làm khoá upsert cho lệnh import-books")
+def _book_isbn(conn):
+    add_column(conn, "book", "isbn", "VARCHAR(20)")
+    create_index(conn, "ux_book_isbn", "book", "isbn", unique=True)
+
+
+@migration(4, "Thêm Book.updated_at và chỉ mục cho export tăng dần (?since=)")
+def _export_since(conn):
+    if add_column(conn, "book", "updated_at", "DATETIME"):
+        conn.execute(sa.text("UPDATE book SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL"))
+    create_index(conn, "ix_book_updated_at", "book", "updated_at, id")
+    create_index(conn, "ix_loan_returned_at", "loan", "returned_at")
+
+
+@migration(5, "Thêm Book.title_sort (khoá sắp xếp tiếng Việt), backfill và chỉ mục thay cho ix_book_title")
+def _book_title_sort(conn):
+    add_column(conn, "book", "title_sort", "VARCHAR(640)")
+    update = sa.text("UPDATE book SET title_sort = :key WHERE id = :id")
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.text("SELECT id, title FROM book WHERE id > :last ORDER BY id LIMIT :n"),
+            {"last": last_id, "n": BACKFILL_BATCH},
+        ).all()
+        if not rows:
+            break
+        conn.execute(update, [{"id": r.id, "key": sort_key(r.title)} for r in rows])
+        last_id = rows[-1].id
+    create_index(conn, "ix_book_title_sort", "book", "title_sort, id")
+    conn.execute(sa.text("DROP INDEX IF EXISTS ix_book_title"))
+
+
+@migration(6, "Mở rộng ix_loan_returned_at thành (returned_at, borrowed_at) cho phân trang phiếu mượn")
+def _loan_returned_borrowed(conn):
+    # Không có thống kê, SQLite chọn chỉ mục returned_at (so sánh bằng) rồi sắp xếp tạm
+    # toàn bộ phiếu đang mở; thêm borrowed_at vào chỉ mục thì thứ tự có sẵn
+    create_index(conn, "ix_loan_returned_borrowed", "loan", "returned_at, borrowed_at")
+    conn.execute(sa.text("DROP INDEX IF EXISTS ix_loan_returned_at"))
+    # partial index phiếu đang mở (migration 2) không còn được chọn nhưng vẫn tốn công ghi
+    conn.execute(sa.text("DROP INDEX IF EXISTS ix_loan_open_borrowed_at"))
+
+
+@migration(7, "Thêm bảng borrower, Loan.borrower_id (backfill từ Loan.borrower) và chỉ mục theo người mượn")
+def _loan_borrower_id(conn):
+    add_column(conn, "loan", "borrower_id", "INTEGER REFERENCES borrower (id)")
+    # Đi theo id từng lô (loan.borrower không có chỉ mục: UPDATE ... WHERE borrower = :tên sẽ quét
+    # cả bảng cho mỗi tên), tra tên -> id người mượn trong Python
+    insert = sa.text("INSERT INTO borrower (name, name_key) VALUES (:name, :key) ON CONFLICT (name_key) DO NOTHING")
+    lookup = sa.text("SELECT name_key, id FROM borrower WHERE name_key IN :keys").bindparams(
+        sa.bindparam("keys", expanding=True)
+    )
+    update = sa.text("UPDATE loan SET borrower_id = :bid WHERE id = :id")
+    ids = {}
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.text("SELECT id, borrower FROM loan WHERE id > :last AND borrower_id IS NULL ORDER BY id LIMIT :n"),
+            {"last": last_id, "n": BACKFILL_BATCH},
+        ).all()
+        if not rows:
+            break
+        keys = [name_key(r.borrower) for r in rows]
+        # tên trùng khoá (khác hoa/thường, khoảng trắng) gộp về cùng một người mượn
+        missing = {key: " ".join(r.borrower.split()) for key, r in zip(keys, rows) if key not in ids}
+        if missing:
+            conn.execute(insert, [{"name": name, "key": key} for key, name in missing.items()])
+            ids.update(conn.execute(lookup, {"keys": list(missing)}).all())
+        conn.execute(update, [{"bid": ids[key], "id": r.id} for key, r in zip(keys, rows)])
+        last_id = rows[-1].id
+    create_index(conn, "ix_loan_borrower_returned", "loan", "borrower_id, returned_at")
+    create_index(conn, "ix_loan_borrower_borrowed", "loan", "borrower_id, borrowed_at")
+
+
+@migration(8, "Backfill bộ đếm lượt mượn (book_borrow_count, book_borrow_daily) từ loan")
+def _borrow_counters(conn):
+    backfill_borrow_counters(conn)
+
+
+def backfill_borrow_counters(conn, daily_days: int = 31) -> None:
+    """Tính lại bộ đếm từ phiếu mượn (kể cả loan_archive nếu ở cùng DB) bằng vài câu GROUP BY."""
+    loans = "SELECT book_id, borrowed_at FROM loan"
+    if sa.inspect(conn).has_table("loan_archive"):
+        loans += " UNION ALL SELECT book_id, borrowed_at FROM loan_archive"
+    conn.execute(sa.text("DELETE FROM book_borrow_count"))
+    conn.execute(sa.text("DELETE FROM book_borrow_daily"))
+    conn.execute(sa.text(
+        f"INSERT INTO book_borrow_count (book_id, total) "
+        f"SELECT book_id, count(*) FROM ({loans}) AS l GROUP BY book_id"
+    ))
+    since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=daily_days)
+    conn.execute(sa.text(
+        f"INSERT INTO book_borrow_daily (day, book_id, loans) "
+        f"SELECT date(borrowed_at), book_id, count(*) FROM ({loans}) AS l "
+        f"WHERE borrowed_at >= :since GROUP BY date(borrowed_at), book_id"
+    ), {"since": since})
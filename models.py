@@ -1,26 +1,76 @@
-from flask import Flask
+from flask import Flask, g
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
+from sqlalchemy.exc import IntegrityError
+from engine_profile import configure_engine, install_sqlite_pragmas
+from routing import READ_BIND_KEY, RoutingSession
+from json_provider import init_json
+from textnorm import name_key, sort_key
+from migrations import run_migrations, schema_lock
+from sqlstats import init_sql_stats
 from pathlib import Path
+import os
 from datetime import datetime
 
-db = SQLAlchemy()
+# SELECT của request GET/HEAD đi engine chỉ đọc nếu có (xem routing.py)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 def create_app() -> Flask:
     app = Flask(__name__, instance_relative_config=True)
     app.config["SECRET_KEY"] = "dev-secret-change-me"
+    # orjson nếu đã cài, không thì JSON chuẩn của Flask
+    init_json(app)
 
     # ensure instance/ exists
     instance_path = Path(app.instance_path)
     instance_path.mkdir(parents=True, exist_ok=True)
 
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{instance_path / 'library.db'}"
+    # DATABASE_URL (SQLite hoặc DB server), DB_PROFILE=default|production, DB_POOL_SIZE, ...
+    configure_engine(app, default_uri=f"sqlite:///{instance_path / 'library.db'}")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Số response GET được giữ trong cache mỗi worker (0 = tắt cache)
+    app.config["RESPONSE_CACHE_SIZE"] = 512
+    # Số kết quả facet (/api/books?facets=) được cache mỗi worker
+    app.config["FACET_CACHE_SIZE"] = 256
+    # Đo SQL mỗi request: cùng một câu lặp >= ngưỡng này thì bị coi là nghi N+1.
+    # SQL_STRICT=1: ném QueryBudgetExceeded khi có N+1 hoặc vượt ngân sách số câu truy vấn
+    # (SQL_QUERY_BUDGET chung, SQL_QUERY_BUDGETS ghi đè theo endpoint) -> test fail.
+    app.config["SQL_N_PLUS_ONE_THRESHOLD"] = 5
+    app.config["SQL_STRICT"] = os.environ.get("SQL_STRICT") == "1"
+    app.config["SQL_QUERY_BUDGET"] = None
+    app.config["SQL_QUERY_BUDGETS"] = {}
+    # Câu lệnh chạy lâu hơn ngưỡng (ms) được log kèm tham số, route và EXPLAIN QUERY PLAN;
+    # xem tổng hợp ở /debug/slow-queries (khi debug hoặc SQL_DEBUG_ENDPOINTS=True)
+    slow_ms = os.environ.get("SLOW_QUERY_THRESHOLD_MS", "100")
+    app.config["SLOW_QUERY_THRESHOLD_MS"] = float(slow_ms) if slow_ms else None
+    app.config["SQL_DEBUG_ENDPOINTS"] = False
+    # Dựng chỉ mục gợi ý (/api/books/suggest) ngay khi khởi động; SUGGEST_PRELOAD=0 để dựng lười
+    # ở request đầu tiên (vd. lệnh CLI không cần đến chỉ mục)
+    app.config["SUGGEST_PRELOAD"] = os.environ.get("SUGGEST_PRELOAD", "1") != "0"
+    # Số phiếu đang mở tối đa của một người mượn (0 = không giới hạn)
+    app.config["MAX_ACTIVE_LOANS_PER_BORROWER"] = int(os.environ.get("MAX_ACTIVE_LOANS_PER_BORROWER", "5"))
+    # `flask archive-loans`: phiếu đã trả quá số ngày này được chuyển sang loan_archive
+    app.config["LOAN_ARCHIVE_AFTER_DAYS"] = int(os.environ.get("LOAN_ARCHIVE_AFTER_DAYS", "365"))
 
     db.init_app(app)
 
     with app.app_context():
-        db.create_all()
+        install_sqlite_pragmas(db.engine, app.config["SQLITE_PRAGMAS"])
+        install_sqlite_pragmas(db.engines["archive"], app.config["SQLITE_ARCHIVE_PRAGMAS"])
+        if READ_BIND_KEY in db.engines:
+            install_sqlite_pragmas(db.engines[READ_BIND_KEY], app.config["SQLITE_READ_PRAGMAS"])
+        for engine in db.engines.values():
+            init_sql_stats(app, engine)
+        # Nhiều worker khởi động cùng lúc: từng process lần lượt tạo bảng và chạy migration
+        with schema_lock(db.engine):
+            db.create_all()
+            # DB cũ (instance/library.db) được bổ sung cột/chỉ mục mới mà không cần tạo lại
+            run_migrations(db.engine)
+            # loan_archive có thể ở DB khác mà migrations không chạy tới: bổ sung chỉ mục còn thiếu
+            for index in LoanArchive.__table__.indexes:
+                index.create(db.engines["archive"], checkfirst=True)
+            _ensure_catalog_version()
 
     return app
 
@@ -33,19 +83,204 @@ class Book(db.Model):
     year = db.Column(db.Integer)                    # 🆕 thêm năm xuất bản
     total_copies = db.Column(db.Integer, default=1, nullable=False)
     available_copies = db.Column(db.Integer, default=1, nullable=False)
+    isbn = db.Column(db.String(20))                 # khoá tự nhiên khi nhập danh mục (upsert)
+    # Khoá sắp xếp tiếng Việt của title (textnorm.sort_key): ORDER BY đúng chữ cái, đi theo chỉ mục.
+    # default tính cho cả INSERT Core (import-books); ORM cập nhật qua @validates("title")
+    title_sort = db.Column(db.String(640), default=lambda ctx: sort_key(ctx.get_current_parameters()["title"]))
+    # Lần sửa cuối (kể cả thay đổi tồn kho): phục vụ export tăng dần ?since=
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_book_title_sort", "title_sort", "id"),
+        db.Index("ux_book_isbn", "isbn", unique=True),
+        db.Index("ix_book_updated_at", "updated_at", "id"),
+    )
+
+    @validates("title")
+    def _set_title_sort(self, key, title):
+        self.title_sort = sort_key(title)
+        return title
 
     def __repr__(self) -> str:
         return f"<Book {self.title} ({self.available_copies}/{self.total_copies})>"
 
 
+class Borrower(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    # name_key(name): "  Nguyễn  Văn A" và "nguyễn văn a" là cùng một người
+    name_key = db.Column(db.String(120), nullable=False)
+
+    __table_args__ = (
+        db.Index("ux_borrower_name_key", "name_key", unique=True),
+    )
+
+    def __repr__(self) -> str:
+        return f"<Borrower {self.name}>"
+
+
 class Loan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=False)
+    # tên như lúc nhập (hiển thị/export); định danh người mượn là borrower_id
     borrower = db.Column(db.String(120), nullable=False)
+    borrower_id = db.Column(db.Integer, db.ForeignKey("borrower.id"), nullable=False)
     borrowed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     returned_at = db.Column(db.DateTime, nullable=True)
 
     book = db.relationship("Book", backref="loans")
 
+    # Thêm/sửa chỉ mục ở đây thì nhớ thêm migration tương ứng trong migrations.py
+    __table_args__ = (
+        # delete_book / kiểm tra phiếu đang mở theo sách; GROUP BY book_id trên dashboard
+        db.Index("ix_loan_book_returned", "book_id", "returned_at"),
+        # số phiếu đang mở của một người (giới hạn mượn) -> đếm trên chỉ mục
+        db.Index("ix_loan_borrower_returned", "borrower_id", "returned_at"),
+        # lịch sử mượn của một người, mới nhất trước
+        db.Index("ix_loan_borrower_borrowed", "borrower_id", "borrowed_at"),
+        # phiếu mới nhất trên dashboard
+        db.Index("ix_loan_borrowed_at", "borrowed_at"),
+        # export ?since=: phiếu được trả sau một thời điểm; /loans, /api/loans: seek theo
+        # (returned_at IS NULL, borrowed_at, id) không cần sắp xếp tạm
+        db.Index("ix_loan_returned_borrowed", "returned_at", "borrowed_at"),
+    )
+
     def __repr__(self) -> str:
         return f"<Loan book={self.book_id} borrower={self.borrower}>"
+
+
+class BookBorrowCount(db.Model):
+    """Tổng lượt mượn mỗi sách, cộng dồn trong transaction của lượt mượn."""
+    book_id = db.Column(db.Integer, db.ForeignKey("book.id"), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # top mượn nhiều nhất: đọc chỉ mục từ cuối, dừng sau N dòng
+        db.Index("ix_book_borrow_count_total", "total", "book_id"),
+    )
+
+
+class BookBorrowDaily(db.Model):
+    """Lượt mượn theo (ngày UTC, sách); chỉ giữ vài tuần gần nhất cho bảng xếp hạng tuần/tháng."""
+    day = db.Column(db.Date, primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey("book.id"), primary_key=True)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+
+
+class BookRelated(db.Model):
+    """Top-k sách hay được mượn cùng (tính bởi `flask build-recommendations`)."""
+    book_id = db.Column(db.Integer, db.ForeignKey("book.id"), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    related_book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+
+class LoanArchive(db.Model):
+    """Phiếu đã trả lâu ngày, được `flask archive-loans` chuyển khỏi bảng loan (giữ nguyên id).
+
+    Thuộc bind "archive" (có thể là DB khác) nên không có khoá ngoại tới book/borrower.
+    """
+    __tablename__ = "loan_archive"
+    __bind_key__ = "archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    book_id = db.Column(db.Integer, nullable=False)
+    borrower = db.Column(db.String(120), nullable=False)
+    borrower_id = db.Column(db.Integer, nullable=False)
+    borrowed_at = db.Column(db.DateTime, nullable=False)
+    returned_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # cùng thứ tự (borrowed_at, id) với lịch sử trên bảng loan để trộn hai luồng keyset
+    __table_args__ = (
+        db.Index("ix_loan_archive_borrowed_at", "borrowed_at"),
+        db.Index("ix_loan_archive_borrower_borrowed", "borrower_id", "borrowed_at"),
+        db.Index("ix_loan_archive_book_borrowed", "book_id", "borrowed_at"),
+        # /api/loans?status=returned: mới trả trước
+        db.Index("ix_loan_archive_returned_at", "returned_at"),
+    )
+
+
+class CatalogVersion(db.Model):
+    """Một dòng duy nhất (id=1), tăng sau mỗi thay đổi sách/phiếu mượn.
+
+    Nằm trong cùng DB nên mọi worker gunicorn thấy cùng một version.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+def _ensure_catalog_version() -> None:
+    if db.session.get(CatalogVersion, 1) is None:
+        db.session.add(CatalogVersion(id=1, version=0))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # worker khác vừa tạo trước
+            db.session.rollback()
+
+
+def dialect_insert(table, bind_key: str | None = None):
+    """INSERT có on_conflict_do_update/do_nothing cho dialect của bind (SQLite, PostgreSQL)."""
+    if db.engines[bind_key].dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def borrower_ids_for(names) -> dict[str, int]:
+    """{name_key: id} cho các tên, tạo người mượn chưa có; an toàn khi hai request cùng tạo.
+
+    Cả danh sách chỉ tốn một SELECT (thêm một INSERT + SELECT nếu có người mới).
+    """
+    wanted = {name_key(name): " ".join(name.split()) for name in names}
+    lookup = db.select(Borrower.name_key, Borrower.id).where(Borrower.name_key.in_(wanted))
+    ids = dict(db.session.execute(lookup).all())
+    missing = [{"name": name, "name_key": key} for key, name in wanted.items() if key not in ids]
+    if missing:
+        db.session.execute(dialect_insert(Borrower).on_conflict_do_nothing(index_elements=["name_key"]), missing)
+        ids = dict(db.session.execute(lookup).all())
+    return ids
+
+
+def borrower_id_for(name: str) -> int:
+    return borrower_ids_for([name])[name_key(name)]
+
+
+def lock_borrowers(borrower_ids) -> None:
+    """Khoá các dòng borrower tới hết transaction (SELECT ... FOR UPDATE, theo thứ tự id để không deadlock).
+
+    Gọi trước khi đếm phiếu đang mở để kiểm tra giới hạn: trên PostgreSQL hai lượt mượn đồng thời
+    của cùng một người phải chờ nhau ở đây. SQLite bỏ qua FOR UPDATE; ở đó transaction ghi đã giữ
+    khoá cả DB.
+    """
+    db.session.execute(
+        db.select(Borrower.id).where(Borrower.id.in_(set(borrower_ids))).order_by(Borrower.id).with_for_update()
+    )
+
+
+def active_loan_count(borrower_id: int) -> int:
+    return db.session.scalar(
+        db.select(db.func.count())
+        .select_from(Loan)
+        .where(Loan.borrower_id == borrower_id, Loan.returned_at.is_(None))
+    )
+
+
+def catalog_version() -> CatalogVersion:
+    """Version hiện tại, đọc tối đa một lần mỗi request."""
+    if "catalog_version" not in g:
+        g.catalog_version = db.session.get(CatalogVersion, 1, populate_existing=True)
+    return g.catalog_version
+
+
+def bump_catalog_version() -> None:
+    """Gọi trong transaction của mọi thao tác ghi, trước commit."""
+    db.session.execute(
+        db.update(CatalogVersion)
+        .where(CatalogVersion.id == 1)
+        .values(version=CatalogVersion.version + 1, updated_at=datetime.utcnow())
+    )
+    g.pop("catalog_version", None)
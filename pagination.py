@@ -0,0 +1,135 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from models import db
+
+COUNT_MODES = ("none", "exact", "estimate")
+# count=estimate: đếm tối đa chừng này dòng rồi dừng
+ESTIMATE_CAP = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values, direction: str) -> str:
+    payload = {"k": [_dump(v) for v in values], "d": direction}
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        values = [_load(v) for v in payload["k"]]
+        direction = payload["d"]
+    except (binascii.Error, ValueError, KeyError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
+    if direction not in ("next", "prev"):
+        raise InvalidCursor(token)
+    return values, direction
+
+
+def keyset_page(query, columns, cursor: str | None, limit: int, descending: bool = False):
+    """Phân trang kiểu seek theo bộ khoá `columns` (cột cuối phải duy nhất, vd. id).
+
+    Không dùng OFFSET/COUNT: mỗi trang là một lần quét chỉ mục từ vị trí cursor.
+    Thứ tự sẵn có của `query` bị bỏ qua. Trả về (items, next_cursor, prev_cursor).
+    """
+    limit = max(limit, 1)
+    values, direction = decode_cursor(cursor) if cursor else (None, "next")
+    if values is not None and len(values) != len(columns):
+        raise InvalidCursor(cursor)
+    backwards = direction == "prev"
+    # Đi lùi = quét theo chiều ngược lại rồi đảo kết quả
+    scan_desc = descending != backwards
+
+    key = sa.tuple_(*columns)
+    if values is not None:
+        query = query.filter(key < sa.tuple_(*values) if scan_desc else key > sa.tuple_(*values))
+    order = [c.desc() if scan_desc else c.asc() for c in columns]
+    items = query.order_by(None).order_by(*order).limit(limit + 1).all()
+
+    has_more = len(items) > limit
+    items = items[:limit]
+    if backwards:
+        items.reverse()
+    if not items:
+        return items, None, None
+
+    first = [getattr(items[0], c.key) for c in columns]
+    last = [getattr(items[-1], c.key) for c in columns]
+    if backwards:
+        next_cursor = encode_cursor(last, "next")
+        prev_cursor = encode_cursor(first, "prev") if has_more else None
+    else:
+        next_cursor = encode_cursor(last, "next") if has_more else None
+        prev_cursor = encode_cursor(first, "prev") if values is not None else None
+    return items, next_cursor, prev_cursor
+
+
+def merged_keyset_page(sources, cursor: str | None, limit: int, descending: bool = False):
+    """keyset_page trên nhiều nguồn có cùng bộ khoá (vd. bảng loan + loan_archive), trộn theo khoá.
+
+    `sources`: [(query, columns), ...], tên cột khoá giống nhau ở mọi nguồn. Mỗi nguồn chỉ đọc
+    tối đa limit + 1 dòng từ vị trí cursor; cursor trả về dùng chung cho mọi nguồn.
+    """
+    limit = max(limit, 1)
+    backwards = bool(cursor) and decode_cursor(cursor)[1] == "prev"
+    items, has_more = [], False
+    for query, columns in sources:
+        page, next_cursor, prev_cursor = keyset_page(query, columns, cursor, limit, descending)
+        items.extend(page)
+        has_more = has_more or (prev_cursor if backwards else next_cursor) is not None
+
+    keys = [c.key for c in sources[0][1]]
+
+    def key_of(item):
+        return [getattr(item, k) for k in keys]
+
+    items.sort(key=key_of, reverse=descending)
+    if len(items) > limit:
+        has_more = True
+        items = items[-limit:] if backwards else items[:limit]
+    if not items:
+        return items, None, None
+
+    if backwards:
+        next_cursor = encode_cursor(key_of(items[-1]), "next")
+        prev_cursor = encode_cursor(key_of(items[0]), "prev") if has_more else None
+    else:
+        next_cursor = encode_cursor(key_of(items[-1]), "next") if has_more else None
+        prev_cursor = encode_cursor(key_of(items[0]), "prev") if cursor else None
+    return items, next_cursor, prev_cursor
+
+
+def estimate_count(query, upper_bound=None):
+    """Đếm có chặn trên: chính xác khi <= ESTIMATE_CAP dòng.
+
+    Vượt ngưỡng thì trả về `upper_bound()` nếu có (vd. max(id), chỉ đọc chỉ mục),
+    không thì trả về chính ngưỡng (cận dưới). Kết quả: (số lượng, là_ước_lượng).
+    """
+    capped = query.order_by(None).limit(ESTIMATE_CAP + 1).subquery()
+    n = db.session.execute(sa.select(sa.func.count()).select_from(capped)).scalar()
+    if n <= ESTIMATE_CAP:
+        return n, False
+    if upper_bound is not None:
+        return upper_bound(), True
+    return ESTIMATE_CAP, True
+
+
+def _dump(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _load(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value["dt"])
+    return value
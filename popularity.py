@@ -0,0 +1,72 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from models import db, Book, BookBorrowCount, BookBorrowDaily, dialect_insert
+
+# window -> số ngày tính cả hôm nay (None = từ trước tới nay, đọc bảng tổng)
+POPULAR_WINDOWS = {"week": 7, "month": 30, "all": None}
+# Bucket ngày cũ hơn mọi window thì bị xoá để bảng luôn nhỏ
+DAILY_RETENTION_DAYS = max(d for d in POPULAR_WINDOWS.values() if d) + 1
+
+_last_pruned = {"day": None}
+
+
+def record_borrows(book_ids, when: datetime | None = None) -> None:
+    """Cộng lượt mượn vào bộ đếm tổng và bucket theo ngày (gọi trong transaction của lượt mượn).
+
+    Upsert cộng dồn (ON CONFLICT DO UPDATE count = count + ...) nên các request đồng thời
+    không làm mất lượt; một lô nhiều cuốn chỉ tốn hai câu executemany.
+    """
+    counts = Counter(book_ids)
+    if not counts:
+        return
+    day = (when or datetime.utcnow()).date()
+
+    stmt = dialect_insert(BookBorrowCount)
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["book_id"], set_={"total": BookBorrowCount.total + stmt.excluded.total}
+        ),
+        [{"book_id": book_id, "total": n} for book_id, n in counts.items()],
+    )
+    stmt = dialect_insert(BookBorrowDaily)
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["day", "book_id"], set_={"loans": BookBorrowDaily.loans + stmt.excluded.loans}
+        ),
+        [{"day": day, "book_id": book_id, "loans": n} for book_id, n in counts.items()],
+    )
+
+    # dọn bucket hết hạn mỗi ngày một lần (mỗi worker)
+    if _last_pruned["day"] != day:
+        db.session.execute(
+            db.delete(BookBorrowDaily).where(BookBorrowDaily.day < day - timedelta(days=DAILY_RETENTION_DAYS))
+        )
+        _last_pruned["day"] = day
+
+
+def popular_books(window: str, limit: int) -> list:
+    """Sách được mượn nhiều nhất trong window, chỉ đọc bảng đếm rồi join vài dòng Book."""
+    days = POPULAR_WINDOWS[window]
+    if days is None:
+        top = (
+            db.select(BookBorrowCount.book_id, BookBorrowCount.total.label("loans"))
+            .order_by(BookBorrowCount.total.desc(), BookBorrowCount.book_id.desc())
+            .limit(limit)
+            .subquery()
+        )
+    else:
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        top = (
+            db.select(BookBorrowDaily.book_id, db.func.sum(BookBorrowDaily.loans).label("loans"))
+            .where(BookBorrowDaily.day >= since)
+            .group_by(BookBorrowDaily.book_id)
+            .order_by(db.desc("loans"), BookBorrowDaily.book_id.desc())
+            .limit(limit)
+            .subquery()
+        )
+    return db.session.execute(
+        db.select(Book.id, Book.title, Book.author, top.c.loans)
+        .join(top, top.c.book_id == Book.id)
+        .order_by(top.c.loans.desc(), Book.id.desc())
+    ).all()
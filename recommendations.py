@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from models import db, Book, BookRelated, Loan, LoanArchive
+
+# Số dòng lấy từ DB mỗi lần khi dựng ma trận; số sách tính đồng thời (giới hạn bộ nhớ)
+LOAD_CHUNK = 100000
+BOOK_BLOCK = 2000
+WRITE_BATCH = 5000
+
+
+def build_related(top_k: int = 10, min_common: int = 1, since: datetime | None = None) -> dict:
+    """Tính "người mượn sách này cũng mượn" cho mọi sách và ghi vào book_related.
+
+    Ma trận thưa người mượn x sách (scipy.sparse), độ tương đồng cosine của hai cột:
+    số người mượn cả hai / sqrt(số người mượn mỗi sách). Đồng xuất hiện được tính theo khối
+    BOOK_BLOCK sách (Mt[khối] @ M) nên bộ nhớ không phụ thuộc kích thước danh mục.
+
+    since: chỉ tính lại các sách của người mượn có phiếu từ thời điểm đó (chạy định kỳ);
+    không có since thì tính lại toàn bộ (chạy hằng đêm).
+    """
+    import numpy as np
+    from scipy import sparse
+
+    borrowers, books = _load_pairs(np)
+    if not len(books):
+        return {"books": 0, "rows": 0}
+    borrower_keys, rows = np.unique(borrowers, return_inverse=True)
+    book_ids, cols = np.unique(books, return_inverse=True)
+    m = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(borrower_keys), len(book_ids))
+    )
+    m.data[:] = 1  # một người mượn một sách nhiều lần vẫn tính là 1
+    mt = m.T.tocsr()
+    inv_norm = 1 / np.sqrt(np.asarray(m.sum(axis=0)).ravel())
+
+    if since is None:
+        targets = np.arange(len(book_ids))
+    else:
+        recent = np.fromiter(
+            db.session.scalars(db.select(Loan.borrower_id).where(Loan.borrowed_at >= since).distinct()),
+            dtype=np.int64,
+        )
+        recent_rows = np.searchsorted(borrower_keys, recent[np.isin(recent, borrower_keys)])
+        # mọi sách của những người này (cả sách mượn từ trước) đều có thể đổi danh sách liên quan
+        targets = np.unique(m[recent_rows].indices)
+
+    written = 0
+    batch = []
+    if since is None:
+        db.session.execute(db.delete(BookRelated))
+    for start in range(0, len(targets), BOOK_BLOCK):
+        block = targets[start:start + BOOK_BLOCK]
+        co = (mt[block] @ m).tocsr()                      # khối x sách: số người mượn chung
+        counts = co.data.copy()
+        row_of = np.repeat(np.arange(len(block)), np.diff(co.indptr))
+        scores = counts * inv_norm[block][row_of] * inv_norm[co.indices]
+
+        if since is not None:
+            ids = [int(book_ids[i]) for i in block]
+            db.session.execute(db.delete(BookRelated).where(BookRelated.book_id.in_(ids)))
+        for r, book in enumerate(block):
+            lo, hi = co.indptr[r], co.indptr[r + 1]
+            related, score = co.indices[lo:hi], scores[lo:hi]
+            keep = (related != book) & (counts[lo:hi] >= min_common)
+            related, score = related[keep], score[keep]
+            if len(related) > top_k:
+                part = np.argpartition(-score, top_k)[:top_k]
+                related, score = related[part], score[part]
+            order = np.lexsort((book_ids[related], -score))   # điểm giảm dần, hoà thì id nhỏ trước
+            for rank, j in enumerate(order, start=1):
+                batch.append({
+                    "book_id": int(book_ids[book]),
+                    "rank": rank,
+                    "related_book_id": int(book_ids[related[j]]),
+                    "score": round(float(score[j]), 6),
+                })
+            if len(batch) >= WRITE_BATCH:
+                db.session.execute(db.insert(BookRelated), batch)
+                written += len(batch)
+                batch = []
+    if batch:
+        db.session.execute(db.insert(BookRelated), batch)
+        written += len(batch)
+    return {"books": int(len(targets)), "rows": written}
+
+
+def _load_pairs(np):
+    """(borrower_id, book_id) từ loan và loan_archive, đọc theo lô thành mảng numpy."""
+    borrowers, books = [], []
+    for model in (Loan, LoanArchive):
+        result = db.session.execute(
+            db.select(model.borrower_id, model.book_id).execution_options(yield_per=LOAD_CHUNK)
+        )
+        for part in result.partitions():
+            pairs = np.array(part, dtype=np.int64)
+            borrowers.append(pairs[:, 0])
+            books.append(pairs[:, 1])
+    if not books:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(borrowers), np.concatenate(books)
+
+
+def related_books(book_id: int, limit: int) -> list:
+    """Tra bảng đã tính sẵn theo khoá chính (book_id, rank)."""
+    return db.session.execute(
+        db.select(Book.id, Book.title, Book.author, BookRelated.score)
+        .join(Book, Book.id == BookRelated.related_book_id)
+        .where(BookRelated.book_id == book_id)
+        .order_by(BookRelated.rank)
+        .limit(limit)
+    ).all()
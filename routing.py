@@ -0,0 +1,33 @@
+import sqlalchemy as sa
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+
+# Bind của engine chỉ đọc trong SQLALCHEMY_BINDS (engine_profile.configure_engine)
+READ_BIND_KEY = "read"
+READ_METHODS = ("GET", "HEAD")
+
+
+class RoutingSession(Session):
+    """Session gửi câu SELECT của request GET/HEAD sang engine chỉ đọc, mọi thứ khác sang primary.
+
+    Chỉ áp cho bind mặc định (loan_archive vẫn theo bind "archive"). Khi chưa cấu hình engine
+    đọc, CLI/luồng nền (không có request) hoặc trong lúc flush thì dùng primary như cũ. Một
+    session đã ghi (flush, INSERT/UPDATE/DELETE, câu text) thì đọc tiếp từ primary tới hết
+    request để thấy dữ liệu vừa ghi.
+    """
+
+    def __init__(self, db, **kwargs):
+        super().__init__(db, **kwargs)
+        self._wrote = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        engines = self._db.engines
+        if bind is not None or READ_BIND_KEY not in engines or engine is not engines[None]:
+            return engine
+        if self._flushing or not isinstance(clause, sa.sql.expression.SelectBase):
+            self._wrote = True
+            return engine
+        if self._wrote or not has_request_context() or request.method not in READ_METHODS:
+            return engine
+        return engines[READ_BIND_KEY]
@@ -0,0 +1,134 @@
+import re
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from migrations import schema_lock
+from models import db, Book
+from textnorm import fold
+
+FTS_TABLE = "book_fts"
+# Trọng số bm25 cho các cột (title, author, genre): khớp tên sách xếp trên cùng
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+REBUILD_BATCH = 5000
+
+_TOKEN = re.compile(r"\w+")
+
+_insert_row = sa.text(
+    f"INSERT INTO {FTS_TABLE}(rowid, title, author, genre) VALUES (:id, :title, :author, :genre)"
+)
+_delete_row = sa.text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id")
+
+
+def init_search(app) -> None:
+    """Bật tìm kiếm FTS5 (nếu SQLite hỗ trợ).
+
+    Lúc khởi động chỉ kiểm tra bảng đã có chưa (một lần đọc sqlite_master). Bảng được tạo và nạp
+    lần đầu đúng một lần, trong schema_lock; sau đó chỉ mục được cập nhật theo từng lần ghi, cần
+    dựng lại (vd. sau khi sửa thẳng bảng book) thì chạy `flask rebuild-search-index`.
+    """
+    with app.app_context():
+        if db.engine.dialect.name != "sqlite":
+            return
+        if not _fts_table_exists():
+            with schema_lock(db.engine):
+                # worker khác có thể vừa tạo xong trong lúc chờ khoá
+                if not _fts_table_exists():
+                    try:
+                        db.session.execute(sa.text(
+                            f"CREATE VIRTUAL TABLE {FTS_TABLE} "
+                            "USING fts5(title, author, genre, tokenize='unicode61 remove_diacritics 2')"
+                        ))
+                    except OperationalError:
+                        # SQLite build không có FTS5 -> dùng ILIKE như cũ
+                        db.session.rollback()
+                        app.logger.warning("SQLite không hỗ trợ FTS5, tìm kiếm dùng ILIKE")
+                        return
+                    rebuild_search_index()
+        app.extensions["book_fts"] = True
+
+
+def fts_enabled() -> bool:
+    return bool(current_app.extensions.get("book_fts"))
+
+
+def match_expression(q: str) -> str:
+    """"Lập trình C" -> '"lap"* "trinh"* "c"*' (AND các tiền tố đã bỏ dấu)."""
+    return " ".join(f'"{token}"*' for token in _TOKEN.findall(fold(q)))
+
+
+def search_books(query, q: str):
+    """Lọc query Book theo từ khóa, sắp xếp theo độ liên quan (bm25).
+
+    Caller có thể nối thêm order_by (vd. theo tên) để phân định các kết quả cùng điểm.
+    """
+    if not fts_enabled():
+        pattern = f"%{q}%"
+        return query.filter(
+            Book.title.ilike(pattern) | Book.author.ilike(pattern) | Book.genre.ilike(pattern)
+        )
+
+    match = match_expression(q)
+    if not match:
+        # q không có chữ/số nào (vd. "!!!"): không khớp sách nào, không phải cả danh mục
+        return query.filter(sa.false())
+    weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+    hits = (
+        sa.select(
+            sa.literal_column("rowid").label("book_id"),
+            sa.literal_column(f"bm25({FTS_TABLE}, {weights})").label("score"),
+        )
+        .select_from(sa.table(FTS_TABLE))
+        .where(sa.text(f"{FTS_TABLE} MATCH :fts_match").bindparams(fts_match=match))
+        .subquery("hits")
+    )
+    return query.join(hits, hits.c.book_id == Book.id).order_by(hits.c.score)
+
+
+def _fts_table_exists() -> bool:
+    return db.session.execute(
+        sa.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first() is not None
+
+
+def rebuild_search_index() -> None:
+    """Xoá và nạp lại toàn bộ chỉ mục theo từng lô id (dùng sau các thao tác bulk)."""
+    db.session.execute(sa.text(f"DELETE FROM {FTS_TABLE}"))
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            sa.select(Book.id, Book.title, Book.author, Book.genre)
+            .where(Book.id > last_id)
+            .order_by(Book.id)
+            .limit(REBUILD_BATCH)
+        ).all()
+        if not rows:
+            break
+        db.session.execute(_insert_row, [_fts_row(r) for r in rows])
+        last_id = rows[-1].id
+    db.session.commit()
+
+
+def _fts_row(book) -> dict:
+    return {
+        "id": book.id,
+        "title": fold(book.title),
+        "author": fold(book.author),
+        "genre": fold(book.genre),
+    }
+
+
+# Đồng bộ chỉ mục trong cùng transaction với thao tác ghi Book
+@sa.event.listens_for(Book, "after_insert")
+@sa.event.listens_for(Book, "after_update")
+def _index_book(mapper, connection, target):
+    if fts_enabled():
+        connection.execute(_delete_row, {"id": target.id})
+        connection.execute(_insert_row, _fts_row(target))
+
+
+@sa.event.listens_for(Book, "after_delete")
+def _unindex_book(mapper, connection, target):
+    if fts_enabled():
+        connection.execute(_delete_row, {"id": target.id})
@@ -1,6 +1,8 @@
-from models import create_app, db, Book
+from models import create_app, db, Book, bump_catalog_version
+from search import init_search, rebuild_search_index
 
 app = create_app()
+init_search(app)
 
 with app.app_context():
     print("🧹 Đang xoá dữ liệu cũ trong bảng Book...")
@@ -53,5 +55,8 @@ with app.app_context():
             )
         )
 
+    bump_catalog_version()
     db.session.commit()
+    # Book.query.delete() không qua mapper event -> dựng lại chỉ mục tìm kiếm
+    rebuild_search_index()
     print(f"✅ Đã thêm {len(samples)} sách mẫu mới vào cơ sở dữ liệu!")
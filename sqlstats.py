@@ -0,0 +1,210 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from threading import Lock
+
+import sqlalchemy as sa
+from flask import abort, current_app, g, has_app_context, has_request_context, request
+
+logger = logging.getLogger("library.sql")
+
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class RequestSqlStats:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.queries += 1
+        self.seconds += elapsed
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold: int) -> list[dict]:
+        """Các câu lệnh cùng dạng lặp >= threshold lần trong một request: nghi N+1."""
+        return [
+            {"statement": shape, "count": n}
+            for shape, n in self.shapes.most_common()
+            if n >= threshold
+        ]
+
+
+class SlowQueryLog:
+    """Gom các câu chậm theo dạng câu lệnh để xem câu nào tốn nhiều thời gian nhất."""
+
+    def __init__(self, threshold_ms: float):
+        self.threshold_ms = threshold_ms
+        self._entries = {}
+        self._lock = Lock()
+
+    def record(self, statement: str, parameters, elapsed_ms: float, endpoint, plan: list[str]) -> None:
+        shape = statement_shape(statement)
+        with self._lock:
+            entry = self._entries.get(shape)
+            if entry is None:
+                entry = self._entries[shape] = {
+                    "statement": shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "endpoints": Counter(),
+                }
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            if elapsed_ms >= entry["max_ms"]:
+                entry["max_ms"] = elapsed_ms
+                entry["params"] = repr(parameters)
+            entry["endpoints"][endpoint or "<ngoài request>"] += 1
+            entry["plan"] = plan
+            # "SCAN <bảng>" = quét toàn bảng; bảng ảo FTS được lọc bởi MATCH nên không tính
+            entry["full_scan"] = any(
+                step.lstrip().startswith("SCAN ") and "VIRTUAL TABLE" not in step for step in plan
+            )
+
+    def worst(self, n: int = 20) -> list[dict]:
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: e["total_ms"], reverse=True)[:n]
+            return [
+                dict(e, total_ms=round(e["total_ms"], 2), max_ms=round(e["max_ms"], 2),
+                     endpoints=dict(e["endpoints"]))
+                for e in entries
+            ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def statement_shape(statement: str) -> str:
+    """Chuẩn hoá câu SQL: gộp khoảng trắng và danh sách IN (?, ?, ...) về một dạng."""
+    return _IN_LIST.sub("(?...)", _SPACES.sub(" ", statement).strip())
+
+
+def init_sql_stats(app, engine) -> None:
+    """Đếm số câu lệnh + tổng thời gian DB mỗi request, gắn vào header và log."""
+    sa.event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    sa.event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    if not app.extensions.get("sql_stats"):
+        app.extensions["sql_stats"] = True
+        app.before_request(_start_request)
+        app.after_request(_finish_request)
+        if app.config["SLOW_QUERY_THRESHOLD_MS"] is not None:
+            app.extensions["slow_queries"] = SlowQueryLog(app.config["SLOW_QUERY_THRESHOLD_MS"])
+        app.add_url_rule("/debug/slow-queries", "slow_queries", _slow_queries_view)
+
+
+def current_stats() -> RequestSqlStats | None:
+    if has_request_context():
+        return g.get("sql_stats")
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+    slow_log = current_app.extensions.get("slow_queries") if has_app_context() else None
+    if slow_log is not None and elapsed * 1000 >= slow_log.threshold_ms:
+        _log_slow_query(slow_log, conn, statement, parameters, elapsed * 1000, executemany)
+
+
+def _log_slow_query(slow_log, conn, statement, parameters, elapsed_ms, executemany):
+    endpoint = request.endpoint if has_request_context() else None
+    plan = [] if executemany else explain_query_plan(conn, statement, parameters)
+    slow_log.record(statement, parameters, elapsed_ms, endpoint, plan)
+    logger.warning(json.dumps({
+        "event": "slow_query",
+        "ms": round(elapsed_ms, 2),
+        "endpoint": endpoint,
+        "statement": _SPACES.sub(" ", statement).strip(),
+        "params": parameters,
+        "plan": plan,
+    }, ensure_ascii=False, default=str))
+
+
+def explain_query_plan(conn, statement: str, parameters) -> list[str]:
+    """Kết quả EXPLAIN QUERY PLAN của SQLite, mỗi bước một dòng (thụt lề theo cây)."""
+    if conn.dialect.name != "sqlite":
+        return []
+    try:
+        rows = conn.connection.driver_connection.execute(
+            "EXPLAIN QUERY PLAN " + statement, parameters
+        ).fetchall()
+    except Exception as exc:  # không để việc ghi log làm hỏng câu truy vấn thật
+        return [f"<không lấy được plan: {exc}>"]
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def _start_request():
+    g.sql_stats = RequestSqlStats()
+
+
+def _finish_request(response):
+    stats = g.pop("sql_stats", None)
+    if stats is None:
+        return response
+    config = current_app.config
+    suspects = stats.repeated(config["SQL_N_PLUS_ONE_THRESHOLD"])
+    budget = config["SQL_QUERY_BUDGETS"].get(request.endpoint, config["SQL_QUERY_BUDGET"])
+
+    response.headers["X-DB-Queries"] = str(stats.queries)
+    response.headers["X-DB-Time"] = f"{stats.seconds * 1000:.2f}"
+    logger.log(
+        logging.WARNING if suspects else logging.INFO,
+        json.dumps({
+            "event": "sql_stats",
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "queries": stats.queries,
+            "db_time_ms": round(stats.seconds * 1000, 2),
+            "n_plus_one": suspects,
+        }, ensure_ascii=False),
+    )
+
+    if config["SQL_STRICT"]:
+        if suspects:
+            raise QueryBudgetExceeded(
+                f"{request.endpoint}: nghi N+1, {suspects[0]['count']}x {suspects[0]['statement']}"
+            )
+        if budget is not None and stats.queries > budget:
+            raise QueryBudgetExceeded(
+                f"{request.endpoint}: {stats.queries} câu truy vấn, vượt ngân sách {budget}"
+            )
+    return response
+
+
+def _slow_queries_view():
+    """Các câu chậm nhất (theo tổng thời gian) của worker hiện tại; chỉ bật khi debug."""
+    if not (current_app.debug or current_app.config.get("SQL_DEBUG_ENDPOINTS")):
+        abort(404)
+    slow_log = current_app.extensions.get("slow_queries")
+    if slow_log is None:
+        return {"threshold_ms": None, "queries": []}
+    if request.args.get("reset"):
+        slow_log.clear()
+    return {
+        "threshold_ms": slow_log.threshold_ms,
+        "queries": slow_log.worst(request.args.get("limit", 20, type=int)),
+    }
@@ -0,0 +1,105 @@
+"""
+Stress test cho luồng mượn/trả sách
+Bắn hàng nghìn request mượn song song vào MỘT cuốn sách, kiểm tra tồn kho không bao giờ âm
+và số phiếu mượn khớp với số bản đã trừ, rồi so sánh throughput theo số luồng.
+
+Chạy: python stress_loans.py --borrows 2000 --copies 500 --workers 1 2 4 8
+(dùng DB tạm, không đụng instance/library.db)
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir.name, 'stress.db')}"
+
+from app import app  # noqa: E402  (phải import sau khi đặt DATABASE_URL)
+from models import db, Book, Loan  # noqa: E402
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+def reset_book(copies: int) -> int:
+    with app.app_context():
+        Loan.query.delete()
+        Book.query.delete()
+        book = Book(title="Sách stress test", author="Tester", total_copies=copies, available_copies=copies)
+        db.session.add(book)
+        db.session.commit()
+        return book.id
+
+
+def run_parallel(fn, jobs, workers: int):
+    """Chạy fn(job) trên `workers` luồng, mỗi luồng một test client riêng; trả về (số lỗi, giây)."""
+    def chunk(part):
+        client = app.test_client()
+        return sum(1 for job in part if fn(client, job) >= 500)
+
+    parts = [jobs[i::workers] for i in range(workers)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        errors = sum(pool.map(chunk, parts))
+    return errors, time.perf_counter() - start
+
+
+def borrow(client, job):
+    book_id, borrower = job
+    return client.post("/loans", data={"book_id": book_id, "borrower": borrower}).status_code
+
+
+def give_back(client, loan_id):
+    return client.post(f"/loans/{loan_id}/return").status_code
+
+
+def check_round(book_id: int, copies: int, borrows: int, workers: int) -> dict:
+    jobs = [(book_id, f"Người mượn {i}") for i in range(borrows)]
+    errors, elapsed = run_parallel(borrow, jobs, workers)
+
+    with app.app_context():
+        book = db.session.get(Book, book_id)
+        loans = Loan.query.filter_by(book_id=book_id, returned_at=None).count()
+        assert book.available_copies >= 0, f"tồn kho âm: {book.available_copies}"
+        assert loans == copies - book.available_copies, f"lệch: {loans} phiếu, còn {book.available_copies}"
+        assert loans == min(borrows, copies), f"mượn được {loans}, kỳ vọng {min(borrows, copies)}"
+        loan_ids = [l.id for l in Loan.query.filter_by(book_id=book_id).all()]
+
+    # Trả song song, mỗi phiếu hai lần: lần thứ hai không được cộng thêm tồn kho
+    return_errors, return_elapsed = run_parallel(give_back, loan_ids * 2, workers)
+    with app.app_context():
+        book = db.session.get(Book, book_id)
+        assert book.available_copies == copies, f"sau khi trả còn {book.available_copies}/{copies}"
+
+    return {
+        "workers": workers,
+        "borrow_rps": round(borrows / elapsed, 1),
+        "return_rps": round(len(loan_ids) * 2 / return_elapsed, 1),
+        "errors": errors + return_errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--borrows", type=int, default=2000)
+    parser.add_argument("--copies", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        book_id = reset_book(args.copies)
+        results.append(check_round(book_id, args.copies, args.borrows, workers))
+
+    print("=" * 60)
+    print(f"{'luồng':>6} {'mượn/s':>10} {'trả/s':>10} {'lỗi':>6} {'x so với 1 luồng':>18}")
+    base = results[0]["borrow_rps"]
+    for r in results:
+        print(f"{r['workers']:>6} {r['borrow_rps']:>10} {r['return_rps']:>10} {r['errors']:>6} "
+              f"{r['borrow_rps'] / base:>18.2f}")
+    print("=" * 60)
+    print("✅ Tồn kho không âm, số phiếu mượn khớp với số bản đã trừ ở mọi vòng")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+from bisect import bisect_left, insort
+from threading import Lock
+
+from flask import current_app
+
+from models import db, Book, catalog_version
+from textnorm import fold
+
+# Chỉ đánh chỉ mục hậu tố từ các từ đầu (đủ cho gõ tìm, giới hạn bộ nhớ)
+MAX_WORDS = 8
+# Số mục tối đa được duyệt cho một tiền tố (giữ thời gian tra cứu ổn định với tiền tố ngắn)
+SCAN_LIMIT = 500
+
+
+class PrefixIndex:
+    """Chỉ mục tiền tố trong bộ nhớ cho gợi ý tên sách / tác giả (đã bỏ dấu).
+
+    Hai mảng đã sắp xếp, tra bằng bisect: `_starts` chứa cả chuỗi (khớp từ đầu, ưu tiên),
+    `_words` chứa hậu tố bắt đầu từ từ thứ hai ("trinh c++", "c++" của "lap trinh c++").
+    """
+
+    def __init__(self):
+        self._books = {}            # book_id -> (title, author)
+        self._starts = []           # (term, kind, book_id)
+        self._words = []
+        self._lock = Lock()
+        self.version = None         # catalog version lần đồng bộ gần nhất
+        self.synced_at = None       # updated_at lớn nhất đã nạp
+
+    def load(self, rows) -> None:
+        books, starts, words = {}, [], []
+        synced_at = None
+        for book_id, title, author, updated_at in rows:
+            books[book_id] = (title, author)
+            s, w = _terms(book_id, title, author)
+            starts.extend(s)
+            words.extend(w)
+            if updated_at and (synced_at is None or updated_at > synced_at):
+                synced_at = updated_at
+        starts.sort()
+        words.sort()
+        with self._lock:
+            self._books, self._starts, self._words = books, starts, words
+            self.synced_at = synced_at
+
+    def upsert(self, book_id: int, title: str, author: str) -> None:
+        with self._lock:
+            # mượn/trả cũng đổi updated_at: tên và tác giả giữ nguyên thì không phải dịch mảng
+            if self._books.get(book_id) == (title, author):
+                return
+            self._remove(book_id)
+            self._books[book_id] = (title, author)
+            starts, words = _terms(book_id, title, author)
+            for entry in starts:
+                insort(self._starts, entry)
+            for entry in words:
+                insort(self._words, entry)
+
+    def remove(self, book_id: int) -> None:
+        with self._lock:
+            self._remove(book_id)
+
+    def suggest(self, prefix: str, limit: int) -> list[dict]:
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        results, seen = [], set()
+        with self._lock:
+            for entries in (self._starts, self._words):
+                i = bisect_left(entries, (prefix,))
+                for term, kind, book_id in entries[i:i + SCAN_LIMIT]:
+                    if not term.startswith(prefix):
+                        break
+                    title, author = self._books[book_id]
+                    text = title if kind == "title" else author
+                    # tác giả trùng tên chỉ gợi ý một lần; sách trùng tên vẫn tách theo id
+                    dedupe = (kind, book_id if kind == "title" else fold(author))
+                    if dedupe in seen:
+                        continue
+                    seen.add(dedupe)
+                    item = {"type": kind, "text": text}
+                    if kind == "title":
+                        item["book_id"] = book_id
+                    results.append(item)
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    def __len__(self) -> int:
+        return len(self._books)
+
+    def _remove(self, book_id: int) -> None:
+        old = self._books.pop(book_id, None)
+        if old is None:
+            return
+        starts, words = _terms(book_id, *old)
+        for entries, terms in ((self._starts, starts), (self._words, words)):
+            for entry in terms:
+                i = bisect_left(entries, entry)
+                if i < len(entries) and entries[i] == entry:
+                    del entries[i]
+
+
+def _terms(book_id, title, author):
+    starts, words = [], []
+    for kind, text in (("title", fold(title)), ("author", fold(author))):
+        if not text:
+            continue
+        starts.append((text, kind, book_id))
+        tokens = text.split(" ")
+        for i in range(1, min(len(tokens), MAX_WORDS)):
+            words.append((" ".join(tokens[i:]), kind, book_id))
+    return starts, words
+
+
+def get_suggest_index() -> PrefixIndex:
+    """Chỉ mục của worker hiện tại (dựng đầy đủ nếu chưa có), đồng bộ theo catalog version.
+
+    Thay đổi từ worker khác được nạp bù qua Book.updated_at (chỉ mục ix_book_updated_at).
+    """
+    index = current_app.extensions["suggest_index"]
+    version = catalog_version().version
+    if index.version == version:
+        return index
+
+    stmt = db.select(Book.id, Book.title, Book.author, Book.updated_at)
+    if index.synced_at is None:
+        # chưa dựng, hoặc dựng lúc danh mục còn rỗng: nạp đầy đủ
+        index.load(db.session.execute(stmt))
+    else:
+        for book_id, title, author, updated_at in db.session.execute(stmt.where(Book.updated_at >= index.synced_at)):
+            index.upsert(book_id, title, author)
+            index.synced_at = max(index.synced_at, updated_at)
+    index.version = version
+    return index
+
+
+def init_suggest(app) -> None:
+    app.extensions["suggest_index"] = PrefixIndex()
+    if app.config.get("SUGGEST_PRELOAD"):
+        with app.app_context():
+            get_suggest_index()
+
+
+def index_book(book) -> None:
+    """Gọi sau khi thêm/sửa sách (chỉ cập nhật nếu chỉ mục đã được dựng)."""
+    index = current_app.extensions["suggest_index"]
+    if index.version is not None:
+        index.upsert(book.id, book.title, book.author)
+
+
+def unindex_book(book_id: int) -> None:
+    index = current_app.extensions["suggest_index"]
+    if index.version is not None:
+        index.remove(book_id)
@@ -0,0 +1,72 @@
+import re
+import unicodedata
+
+_SPACES = re.compile(r"\s+")
+
+
+def fold(text: str | None) -> str:
+    """Bỏ dấu tiếng Việt + chữ thường: "Lập trình" -> "lap trinh"."""
+    if not text:
+        return ""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _SPACES.sub(" ", stripped).strip().lower()
+
+
+def name_key(text: str | None) -> str:
+    """Khoá so trùng tên người: giữ dấu (Lan != Lân), bỏ khác biệt hoa/thường và khoảng trắng."""
+    if not text:
+        return ""
+    return _SPACES.sub(" ", unicodedata.normalize("NFC", text)).strip().lower()
+
+
+# Bậc của chữ cái có dấu phụ: a < ă < â, e < ê, o < ô < ơ, u < ư (d < đ xử lý riêng)
+_BREVE, _CIRCUMFLEX, _HORN = "\u0306", "\u0302", "\u031b"
+_LETTER_VARIANTS = {
+    ("a", _BREVE): 1, ("a", _CIRCUMFLEX): 2,
+    ("e", _CIRCUMFLEX): 1,
+    ("o", _CIRCUMFLEX): 1, ("o", _HORN): 2,
+    ("u", _HORN): 1,
+}
+# Thứ tự thanh: ngang < huyền < hỏi < ngã < sắc < nặng
+_TONES = {"\u0300": "1", "\u0309": "2", "\u0303": "3", "\u0301": "4", "\u0323": "5"}
+# Nhỏ hơn mọi ký tự của phần khoá chính
+_SECONDARY_SEPARATOR = "\x01"
+
+
+def sort_key(text: str | None) -> str:
+    """Khoá sắp xếp theo bảng chữ cái tiếng Việt, so sánh được bằng collation nhị phân.
+
+    Mỗi ký tự thành 2 ký tự (chữ gốc + bậc biến thể) nên mọi từ bắt đầu bằng "a" đứng
+    trước "ă"; thanh điệu chỉ được xét khi phần chữ bằng nhau (so sánh bậc hai).
+    """
+    if not text:
+        return ""
+    primary, tones = [], []
+    for cluster in _clusters(unicodedata.normalize("NFD", text.lower())):
+        base, marks = cluster[0], cluster[1:]
+        if base.isspace():
+            primary.append("  ")
+            continue
+        variant = 1 if base == "đ" else 0
+        base = "d" if base == "đ" else base
+        tone = "0"
+        for mark in marks:
+            variant = _LETTER_VARIANTS.get((base, mark), variant)
+            tone = _TONES.get(mark, tone)
+        primary.append(f"{base}{variant}")
+        tones.append(tone)
+    return "".join(primary) + _SECONDARY_SEPARATOR + "".join(tones)
+
+
+def _clusters(decomposed: str):
+    """Tách chuỗi NFD thành cụm (ký tự gốc + các dấu kết hợp đi sau)."""
+    cluster = ""
+    for ch in decomposed:
+        if cluster and not unicodedata.combining(ch):
+            yield cluster
+            cluster = ""
+        cluster += ch
+    if cluster:
+        yield cluster